@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Compare dateutil with format_dt on the created/updated timestamps of a synthetic user listing,
+# the way `vagrant-cloud-cli user` formats them for its table.
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+import dateutil.parser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from vagrant_cloud_cli.vcapi import format_dt  # noqa: E402
+
+
+def listing(rows):
+    start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+    boxes = []
+    for i in range(rows):
+        created = start + datetime.timedelta(seconds=random.randrange(300_000_000), milliseconds=random.randrange(1000))
+        updated = created + datetime.timedelta(seconds=random.randrange(30_000_000))
+        boxes.append({"name": "box%d" % i,
+                      "created_at": created.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+                      "updated_at": updated.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"})
+    return boxes
+
+
+def old_format_dt(date_string):
+    return dateutil.parser.parse(date_string).strftime("%c")
+
+
+def measure(func, boxes):
+    started = time.perf_counter()
+    for box in boxes:
+        func(box["created_at"])
+        func(box["updated_at"])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark timestamp formatting over a synthetic user listing")
+    parser.add_argument("-r", "--rows", type=int, default=50000, help="Boxes in the listing (default 50000)")
+    args = parser.parse_args()
+
+    boxes = listing(args.rows)
+    for box in boxes[:1000]:
+        assert format_dt(box["created_at"]) == old_format_dt(box["created_at"]), box["created_at"]
+
+    format_dt.cache_clear()
+    baseline = measure(old_format_dt, boxes)
+    cold = measure(format_dt, boxes)
+    warm = measure(format_dt, boxes)
+    for name, elapsed in (("dateutil.parser.parse", baseline), ("format_dt", cold), ("format_dt, second pass", warm)):
+        print("%-24s %8.3f s %10.2f us/timestamp %6.1fx" % (name, elapsed, elapsed / (args.rows * 2) * 1e6,
+                                                            baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
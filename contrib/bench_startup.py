@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Measure CLI startup: wall time per invocation and the import time reported by `python -X importtime`.
+# Paths that never talk to the API (help, usage errors) must not import requests or the table/date
+# libraries; the script exits non-zero if they do, or if any median exceeds --max-ms.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+RUN = "import sys; from vagrant_cloud_cli import main; sys.argv[0] = 'vagrant-cloud-cli'; main()"
+HEAVY = ("requests", "dateutil", "prettytable")
+SCENARIOS = [
+    # (arguments, whether heavy modules may be imported)
+    (["--help"], False),
+    (["box", "--help"], False),
+    (["box", "provider", "upload", "--help"], False),
+    (["box"], False),
+    (["validate"], True),
+]
+
+
+def run(argv, env):
+    started = time.monotonic()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", RUN] + argv, env=env, cwd=ROOT,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.monotonic() - started
+
+    imported = set()
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        imported.add(name.strip().split(".")[0])
+        # Top-level entries aren't indented, their cumulative times add up to the total
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+    return wall, total / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vagrant-cloud-cli startup time")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="Invocations per scenario (default 10)")
+    parser.add_argument("--max-ms", type=float, help="Fail if a scenario's median wall time exceeds this")
+    args = parser.parse_args()
+
+    # No token, so `validate` stops right after importing everything it needs
+    env = {k: v for k, v in os.environ.items() if k not in ("ATLAS_TOKEN", "VAGRANT_CLOUD_TOKEN")}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+
+    failed = False
+    for argv, heavy_ok in SCENARIOS:
+        walls = []
+        imports = []
+        for _ in range(args.runs):
+            wall, import_ms, imported = run(argv, env)
+            walls.append(wall * 1000)
+            imports.append(import_ms)
+        wall = statistics.median(walls)
+        heavy = sorted(m for m in HEAVY if m in imported)
+        problems = []
+        if heavy and not heavy_ok:
+            problems.append("imports %s" % ", ".join(heavy))
+        if args.max_ms and wall > args.max_ms:
+            problems.append("slower than %.0f ms" % args.max_ms)
+        failed = failed or bool(problems)
+        print("%-40s %8.1f ms wall %8.1f ms imports  %s" % (" ".join(argv), wall, statistics.median(imports),
+                                                           "FAIL: " + "; ".join(problems) if problems else "ok"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# End-to-end benchmarks against the stand-in server: wall time, API requests and peak RSS of
+# each CLI command (run as its own process, like users run it), plus upload and download
+# throughput. Results are written as JSON so runs can be compared across releases.
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+from vagrant_cloud_cli.vcapi import VagrantCloudApi  # noqa: E402
+
+# The command reports its own peak RSS on exit. The ru_maxrss that wait4() returns for a child
+# can't be lower than the RSS of the parent that forked it, so it would measure this script.
+RUN = """
+import atexit, os, sys
+
+def report_rss():
+    try:
+        with open("/proc/self/status") as f:
+            peak = int(next(line.split()[1] for line in f if line.startswith("VmHWM:")))
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak //= 1024
+    with open(os.environ["BENCH_RSS_FILE"], "w") as f:
+        f.write(str(peak))
+
+atexit.register(report_rss)
+from vagrant_cloud_cli import main
+sys.argv[0] = "vagrant-cloud-cli"
+main()
+"""
+
+
+def start_server(args):
+    command = [sys.executable, os.path.join(HERE, "fake_vagrant_cloud.py"), "-p", "0", "-k",
+               "-l", str(args.latency), "-e", str(args.error_rate), "--error-status", str(args.error_status),
+               "--retry-after", "0", "--seed", "0"]
+    if args.bandwidth:
+        command += ["-b", str(args.bandwidth)]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    return proc, proc.stdout.readline().split()[-1]
+
+
+def server_stats(endpoint):
+    return requests.get(endpoint.rsplit("/api/v1", 1)[0] + "/_stats").json()
+
+
+def run_command(argv, env, endpoint):
+    before = server_stats(endpoint)["requests"]
+    fd, rss_file = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        started = time.monotonic()
+        proc = subprocess.Popen([sys.executable, "-c", RUN] + argv, env=dict(env, BENCH_RSS_FILE=rss_file),
+                                cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc.wait()
+        wall = time.monotonic() - started
+        with open(rss_file) as f:
+            max_rss = int(f.read() or 0)
+    finally:
+        os.unlink(rss_file)
+    # The /_stats request itself is counted too
+    requests_made = server_stats(endpoint)["requests"] - before - 1
+    return {"wall_ms": wall * 1000, "requests": requests_made, "max_rss_kib": max_rss,
+            "exit_code": proc.returncode}
+
+
+def measure(name, argv, env, endpoint, runs):
+    samples = [run_command(argv, env, endpoint) for _ in range(runs)]
+    walls = [sample["wall_ms"] for sample in samples]
+    result = {"name": name, "argv": argv, "runs": runs,
+              "wall_ms": {"median": statistics.median(walls), "min": min(walls), "max": max(walls)},
+              "requests": statistics.median(sample["requests"] for sample in samples),
+              "max_rss_kib": max(sample["max_rss_kib"] for sample in samples),
+              "exit_codes": sorted(set(sample["exit_code"] for sample in samples))}
+    print("%-36s %9.1f ms %5g requests %8d KiB" % (name, result["wall_ms"]["median"], result["requests"],
+                                                     result["max_rss_kib"]), file=sys.stderr)
+    return result
+
+
+def setup_call(func, *args, **kwargs):
+    # The client doesn't retry a failed POST, but setup has to get through injected errors
+    for _ in range(20):
+        try:
+            return func(*args, **kwargs)
+        except requests.HTTPError as e:
+            if e.response.status_code < 500:
+                raise
+    raise RuntimeError("Setup request kept failing, lower the error rate")
+
+
+def seed(api, username, boxes):
+    for i in range(boxes):
+        setup_call(api._post, "/boxes", {"box": {"username": username, "name": "seed%d" % i,
+                                                 "short_description": "Seeded box"}})
+        setup_call(api._post, "/box/%s/seed%d/versions" % (username, i), {"version": {"version": "1.0.0"}})
+        setup_call(api._put, "/box/%s/seed%d/version/1.0.0/release" % (username, i))
+
+
+def throughput(api, endpoint, box, size):
+    setup_call(api._post, "/boxes", {"box": {"username": "bench", "name": "transfer"}})
+    setup_call(api._post, "/box/bench/transfer/versions", {"version": {"version": "1.0"}})
+    setup_call(api._post, "/box/bench/transfer/version/1.0/providers", {"provider": {"name": "virtualbox"}})
+    stream = setup_call(api._upload_provider, "bench/transfer", "1.0", "virtualbox", box, checksum_type=None,
+                        force=True)
+
+    url = setup_call(api._get, "/box/bench/transfer/version/1.0/provider/virtualbox").json()["download_url"]
+    started = time.monotonic()
+    received = 0
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(1024 * 1024):
+            received += len(chunk)
+    elapsed = time.monotonic() - started
+
+    # The same file again with 8 concurrent Range requests, like `box provider download`
+    api.show_progress = False
+    download = setup_call(api.download_provider, "bench/transfer", "1.0", "virtualbox",
+                          os.path.join(os.path.dirname(box), "download.box"), jobs=8, verify=False)
+    return {"size_bytes": size, "upload_mib_s": stream.rate / 1024 / 1024,
+            "download_mib_s": received / elapsed / 1024 / 1024,
+            "parallel_download_mib_s": download.rate / 1024 / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the end-to-end benchmark suite against a local stand-in server")
+    parser.add_argument("-o", "--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="Runs of each read-only command (default 5)")
+    parser.add_argument("--boxes", type=int, default=200, help="Boxes to seed the benchmark user with (default 200)")
+    parser.add_argument("-s", "--size", type=int, default=64, help="Size of the test box in MiB (default 64)")
+    parser.add_argument("-l", "--latency", type=float, default=0, help="Server latency per API request in ms")
+    parser.add_argument("-b", "--bandwidth", type=float, help="Server bandwidth limit in MiB/s")
+    parser.add_argument("-e", "--error-rate", type=float, default=0, help="Fraction of API requests to fail")
+    parser.add_argument("--error-status", type=int, default=503, help="Status of injected errors (default 503)")
+    args = parser.parse_args()
+
+    proc, endpoint = start_server(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, ATLAS_TOKEN="bench", VAGRANT_CLOUD_API_ENDPOINT=endpoint, XDG_CACHE_HOME=tmp,
+                   PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+        os.environ.update(ATLAS_TOKEN="bench", VAGRANT_CLOUD_API_ENDPOINT=endpoint)
+        box = os.path.join(tmp, "test.box")
+        with open(box, "wb") as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size):
+                f.write(block)
+
+        try:
+            api = VagrantCloudApi(None)
+            seed(api, "bench", args.boxes)
+
+            once = [
+                ("box create", ["box", "create", "bench", "cli"]),
+                ("box version create", ["box", "version", "create", "bench/cli", "1.0"]),
+                ("box provider create", ["box", "provider", "create", "bench/cli", "1.0", "virtualbox"]),
+                ("box provider upload", ["box", "provider", "upload", "bench/cli", "1.0", "virtualbox", box]),
+                ("box publish (2 providers)", ["box", "publish", "bench/cli", "2.0", "virtualbox=" + box,
+                                               "vmware_desktop=" + box]),
+            ]
+            repeated = [
+                ("validate", ["validate"]),
+                ("user (table)", ["user", "bench"]),
+                ("user (ndjson)", ["--format", "ndjson", "user", "bench"]),
+                ("box info", ["box", "info", "bench/cli"]),
+                ("box version info", ["box", "version", "info", "bench/cli", "1.0"]),
+                ("box provider info", ["box", "provider", "info", "bench/cli", "1.0", "virtualbox"]),
+                ("--help", ["--help"]),
+            ]
+            commands = [measure(name, argv, env, endpoint, 1) for name, argv in once]
+            commands += [measure(name, argv, env, endpoint, args.runs) for name, argv in repeated]
+            transfer = throughput(api, endpoint, box, args.size * 1024 * 1024)
+            server = server_stats(endpoint)
+        finally:
+            proc.terminate()
+
+    results = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"runs": args.runs, "boxes": args.boxes, "size_mib": args.size, "latency_ms": args.latency,
+                   "bandwidth_mib_s": args.bandwidth, "error_rate": args.error_rate,
+                   "error_status": args.error_status},
+        "commands": commands,
+        "throughput": transfer,
+        "server": server,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
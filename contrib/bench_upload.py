@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Compare the old single file-object PUT with UploadStream, both with buffered reads and with
+# the memory-mapped transport, by throughput and client CPU-seconds per GiB. The stand-in server
+# runs in a separate process so its CPU time is not counted.
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from vagrant_cloud_cli.upload import UploadStream, format_size  # noqa: E402
+
+
+def start_server():
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_vagrant_cloud.py"), "-p", "0"],
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    endpoint = proc.stdout.readline().split()[-1]
+    return proc, endpoint.rsplit("/api/v1", 1)[0]
+
+
+def measure(upload):
+    wall = time.monotonic()
+    cpu = time.process_time()
+    upload()
+    return time.monotonic() - wall, time.process_time() - cpu
+
+
+def baseline(session, url, path):
+    with open(path, "rb") as f:
+        session.put(url, data=f).raise_for_status()
+
+
+def streamed(session, url, path, chunk_size, use_mmap, checksum_type):
+    with UploadStream(path, chunk_size, checksum_type=checksum_type, use_mmap=use_mmap) as stream:
+        session.put(url, data=stream).raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark box uploads against a local stand-in server")
+    parser.add_argument("-s", "--size", type=int, default=512, help="Size of the test box in MiB")
+    parser.add_argument("-c", "--chunk-sizes", type=int, nargs="+", default=[1, 4, 16],
+                        help="Chunk sizes to try, in MiB")
+    parser.add_argument("--checksum-type", default="none", help="Checksum to compute while uploading")
+    args = parser.parse_args()
+    checksum_type = args.checksum_type if args.checksum_type != "none" else None
+
+    proc, url = start_server()
+    session = requests.session()
+    try:
+        with tempfile.NamedTemporaryFile() as box:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size):
+                box.write(block)
+            box.flush()
+
+            runs = [("single file-object PUT", lambda: baseline(session, url + "/upload/bench", box.name))]
+            for chunk_size in args.chunk_sizes:
+                for use_mmap in (False, True):
+                    runs.append(("UploadStream, %d MiB chunks, %s" % (chunk_size, "mmap" if use_mmap else "read"),
+                                 lambda c=chunk_size, m=use_mmap: streamed(session, url + "/upload/bench", box.name,
+                                                                           c * 1024 * 1024, m, checksum_type)))
+
+            gib = args.size / 1024
+            for name, upload in runs:
+                wall, cpu = measure(upload)
+                print("%-40s %10s/s %8.3f CPU-s/GiB" % (name, format_size(args.size * 1024 * 1024 / wall),
+                                                         cpu / gib))
+    finally:
+        proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
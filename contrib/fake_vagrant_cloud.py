@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# Local stand-in for the Vagrant Cloud API, used by the benchmarks in this directory.
+# Everything is kept in memory; uploaded boxes are counted, and only stored (and downloadable)
+# with keep_uploads. Downloads honour single-range Range requests, the bandwidth limit applies
+# to each connection. API requests can be slowed down with latency and failed at random with
+# error_rate, 429s carry a Retry-After header. GET /_stats reports request and byte counters.
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeVagrantCloud(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), bandwidth=None, latency=0, error_rate=0, error_status=503,
+                 retry_after=1, keep_uploads=False, seed=None):
+        super().__init__(address, Handler)
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.keep_uploads = keep_uploads
+        self.random = random.Random(seed)
+        self.boxes = {}
+        self.uploads = {}
+        self.upload_targets = {}
+        self.content = {}
+        self.requests = []
+        self.errors = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.lock = threading.RLock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    @property
+    def api_endpoint(self):
+        return self.url + "/api/v1"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def box(self, tag):
+        if tag not in self.boxes:
+            raise NotFound()
+        return self.boxes[tag]
+
+    def version(self, tag, version):
+        for v in self.box(tag)["versions"]:
+            if v["version"] == version:
+                return v
+        raise NotFound()
+
+    def provider(self, tag, version, name):
+        for p in self.version(tag, version)["providers"]:
+            if p["name"] == name:
+                return p
+        raise NotFound()
+
+    def add_box(self, tag, description=None, private=False):
+        username, name = tag.split("/")
+        self.boxes[tag] = {"tag": tag, "username": username, "name": name, "short_description": description,
+                           "private": private, "created_at": now(), "updated_at": now(), "versions": []}
+        return self.boxes[tag]
+
+    def add_version(self, tag, version, description=None, status="unreleased"):
+        v = {"version": version, "status": status, "description_markdown": description, "created_at": now(),
+             "updated_at": now(), "providers": []}
+        self.box(tag)["versions"].insert(0, v)
+        return v
+
+    def add_provider(self, tag, version, name, url=None, checksum=None, checksum_type=None):
+        p = {"name": name, "hosted": False, "original_url": url, "checksum": checksum,
+             "checksum_type": checksum_type, "created_at": now(), "updated_at": now(),
+             "download_url": url or "%s/download/%s/%s/%s" % (self.url, tag, version, name)}
+        self.version(tag, version)["providers"].append(p)
+        return p
+
+    def stats(self):
+        methods = {}
+        for method, _ in self.requests:
+            methods[method] = methods.get(method, 0) + 1
+        return {"requests": len(self.requests), "methods": methods, "errors_injected": self.errors,
+                "bytes_received": self.bytes_received, "bytes_sent": self.bytes_sent}
+
+    def user(self, username):
+        boxes = []
+        for box in self.boxes.values():
+            if box["username"] != username:
+                continue
+            current = next((v for v in box["versions"] if v["status"] == "active"), None)
+            summary = {k: v for k, v in box.items() if k != "versions"}
+            summary["current_version"] = current
+            boxes.append(summary)
+        return {"username": username, "boxes": boxes}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, with Nagle on every reused connection would wait
+    # for the client's delayed ACK before sending the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _throttle(self, transferred, started):
+        bandwidth = self.server.bandwidth
+        if bandwidth:
+            delay = transferred / bandwidth - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _read_body(self, keep=False):
+        # Returns the number of bytes read, or the bytes themselves with keep
+        remaining = int(self.headers.get("Content-Length", 0))
+        received = 0
+        chunks = []
+        started = time.monotonic()
+        while remaining:
+            data = self.rfile.read(min(remaining, 1024 * 1024))
+            if not data:
+                break
+            if keep:
+                chunks.append(data)
+            remaining -= len(data)
+            received += len(data)
+            self._throttle(received, started)
+        with self.server.lock:
+            self.server.bytes_received += received
+        return b"".join(chunks) if keep else received
+
+    def _send_bytes(self, data, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        view = memoryview(data)
+        started = time.monotonic()
+        for offset in range(0, len(data), 1024 * 1024):
+            self.wfile.write(view[offset:offset + 1024 * 1024])
+            self._throttle(min(offset + 1024 * 1024, len(data)), started)
+        with self.server.lock:
+            self.server.bytes_sent += len(data)
+
+    def _inject_error(self):
+        server = self.server
+        with server.lock:
+            if not server.error_rate or server.random.random() >= server.error_rate:
+                return False
+            server.errors += 1
+        headers = {"Retry-After": str(server.retry_after)} if server.error_status == 429 else None
+        self._send_json({"errors": ["Injected error"]}, server.error_status, headers)
+        return True
+
+    def _read_json(self):
+        return json.loads(self.body or b"{}")
+
+    def _handle(self, method):
+        with self.server.lock:
+            self.server.requests.append((method, self.path))
+        parts = self.path.split("?")[0].strip("/").split("/")
+        try:
+            if parts == ["_stats"] and method == "GET":
+                with self.server.lock:
+                    self._send_json(self.server.stats())
+            elif parts[:2] == ["api", "v1"]:
+                self.body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                if self._inject_error():
+                    return
+                with self.server.lock:
+                    self._api(method, parts[2:])
+            elif parts[0] in ("upload", "storage") and method == "PUT":
+                self._upload(parts[0], parts[1])
+            elif parts[0] == "download" and len(parts) == 5 and method == "GET":
+                self._download("/".join(parts[1:3]), parts[3], parts[4])
+            else:
+                raise NotFound()
+        except NotFound:
+            if parts[:2] != ["api", "v1"]:
+                self._read_body()
+            self._send_json({"errors": ["Resource not found!"]}, 404)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _upload(self, kind, token):
+        # Pre-signed object storage URLs reject requests that also carry credentials
+        if kind == "storage" and "Authorization" in self.headers:
+            self._read_body()
+            self._send_json({"errors": ["Only one auth mechanism allowed"]}, 400)
+            return
+        data = self._read_body(keep=self.server.keep_uploads)
+        with self.server.lock:
+            self.server.uploads[token] = len(data) if self.server.keep_uploads else data
+            target = self.server.upload_targets.get(token)
+            if target and self.server.keep_uploads:
+                self.server.content[target] = data
+            if kind == "upload" and target:
+                self.server.provider(*target)["hosted"] = True
+        self._send_json({})
+
+    def _download(self, tag, version, name):
+        data = self.server.content.get((tag, version, name))
+        if data is None:
+            raise NotFound()
+        headers = {"Accept-Ranges": "bytes"}
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if not match or match.groups() == ("", ""):
+            return self._send_bytes(data, headers=headers)
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), len(data) - 1) if last else len(data) - 1
+        else:
+            start, end = max(0, len(data) - int(last)), len(data) - 1
+        if start >= len(data) or end < start:
+            headers["Content-Range"] = "bytes */%d" % len(data)
+            return self._send_bytes(b"", 416, headers)
+        headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, len(data))
+        self._send_bytes(memoryview(data)[start:end + 1], 206, headers)
+
+    def _api(self, method, parts):
+        server = self.server
+        if parts == ["authenticate"] and method == "GET":
+            return self._send_json({})
+        if len(parts) == 2 and parts[0] == "user" and method == "GET":
+            return self._send_json(server.user(parts[1]))
+        if parts == ["boxes"] and method == "POST":
+            data = self._read_json()["box"]
+            tag = "%s/%s" % (data["username"], data["name"])
+            if tag in server.boxes:
+                return self._send_json({"errors": ["Type has already been taken"]}, 422)
+            return self._send_json(server.add_box(tag, data.get("short_description"), data.get("is_private")))
+        if len(parts) == 2 and parts[0] == "callback" and method == "PUT":
+            token = parts[1]
+            if token not in server.uploads:
+                return self._send_json({"errors": ["No upload found"]}, 422)
+            server.provider(*server.upload_targets[token])["hosted"] = True
+            return self._send_json({})
+        if parts[0] != "box" or len(parts) < 3:
+            raise NotFound()
+
+        tag = "/".join(parts[1:3])
+        rest = parts[3:]
+        if not rest:
+            box = server.box(tag)
+            if method == "GET":
+                return self._send_json(box)
+            if method == "PUT":
+                data = self._read_json()["box"]
+                if "short_description" in data:
+                    box["short_description"] = data["short_description"]
+                if "is_private" in data:
+                    box["private"] = data["is_private"]
+                box["updated_at"] = now()
+                return self._send_json(box)
+            if method == "DELETE":
+                return self._send_json(server.boxes.pop(tag))
+        if rest == ["versions"] and method == "POST":
+            data = self._read_json()["version"]
+            if any(v["version"] == data["version"] for v in server.box(tag)["versions"]):
+                return self._send_json({"errors": ["Version has already been taken"]}, 422)
+            return self._send_json(server.add_version(tag, data["version"], data.get("description")))
+        if rest[0] != "version" or len(rest) < 2:
+            raise NotFound()
+
+        version = rest[1]
+        rest = rest[2:]
+        if not rest:
+            v = server.version(tag, version)
+            if method == "GET":
+                return self._send_json(v)
+            if method == "PUT":
+                data = self._read_json()["version"]
+                if data.get("version"):
+                    v["version"] = data["version"]
+                if "description" in data:
+                    v["description_markdown"] = data["description"]
+                return self._send_json(v)
+            if method == "DELETE":
+                server.box(tag)["versions"].remove(v)
+                return self._send_json(v)
+        if rest in (["release"], ["revoke"]) and method == "PUT":
+            v = server.version(tag, version)
+            if rest == ["release"] and v["status"] == "active":
+                return self._send_json({"errors": ["Version is already released"]}, 422)
+            v["status"] = "active" if rest == ["release"] else "revoked"
+            return self._send_json(v)
+        if rest == ["providers"] and method == "POST":
+            data = self._read_json()["provider"]
+            if any(p["name"] == data["name"] for p in server.version(tag, version)["providers"]):
+                return self._send_json({"errors": ["Name has already been taken"]}, 422)
+            return self._send_json(server.add_provider(tag, version, data["name"], data.get("url"),
+                                                       data.get("checksum"), data.get("checksum_type")))
+        if rest[0] != "provider" or len(rest) < 2:
+            raise NotFound()
+
+        name = rest[1]
+        rest = rest[2:]
+        p = server.provider(tag, version, name)
+        if not rest:
+            if method == "GET":
+                return self._send_json(p)
+            if method == "PUT":
+                data = self._read_json()["provider"]
+                for key in ("name", "checksum", "checksum_type"):
+                    if key in data:
+                        p[key] = data[key]
+                if "url" in data:
+                    p["original_url"] = p["download_url"] = data["url"]
+                p["updated_at"] = now()
+                return self._send_json(p)
+            if method == "DELETE":
+                server.version(tag, version)["providers"].remove(p)
+                return self._send_json(p)
+        if rest in (["upload"], ["upload", "direct"]) and method == "GET":
+            token = uuid.uuid4().hex
+            server.upload_targets[token] = (tag, version, name)
+            if rest == ["upload"]:
+                return self._send_json({"upload_path": "%s/upload/%s" % (server.url, token)})
+            return self._send_json({"upload_path": "%s/storage/%s" % (server.url, token),
+                                    "callback": "%s/callback/%s" % (server.api_endpoint, token)})
+        raise NotFound()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in Vagrant Cloud API")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="Port to listen on, 0 picks a free one")
+    parser.add_argument("-b", "--bandwidth", type=float,
+                        help="Per-connection upload/download bandwidth limit in MiB/s")
+    parser.add_argument("-l", "--latency", type=float, default=0, help="Delay every API request by this many ms")
+    parser.add_argument("-e", "--error-rate", type=float, default=0,
+                        help="Fraction of API requests to fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=503, help="Status of injected errors (default 503)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with injected 429s (default 1)")
+    parser.add_argument("-k", "--keep-uploads", action="store_true",
+                        help="Keep uploaded boxes in memory so they can be downloaded")
+    parser.add_argument("--seed", type=int, help="Seed for error injection")
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth * 1024 * 1024 if args.bandwidth else None
+    server = FakeVagrantCloud(("127.0.0.1", args.port), bandwidth, args.latency / 1000, args.error_rate,
+                              args.error_status, args.retry_after, args.keep_uploads, args.seed)
+    print("Serving on %s" % server.api_endpoint, flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
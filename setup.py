@@ -10,6 +10,10 @@ setup(
     author_email="Phoenix09@users.noreply.github.com",
     packages=find_packages(exclude=["contrib", "docs", "tests"]),
     install_requires=["requests", "prettytable", "python-dateutil"],
+    extras_require={
+        "yaml": ["PyYAML"],
+        "async": ["aiohttp"],
+    },
     entry_points={
         "console_scripts": [
             "vagrant-cloud-cli=vagrant_cloud_cli:main",
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "contrib"))
+sys.path.insert(0, ROOT)
+
+from fake_vagrant_cloud import FakeVagrantCloud  # noqa: E402
+from vagrant_cloud_cli.aio import AsyncVagrantCloudApi, aiohttp  # noqa: E402
+from vagrant_cloud_cli.client import NotFoundError  # noqa: E402
+
+
+@unittest.skipUnless(aiohttp, "aiohttp is not installed")
+class AsyncApiTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.box = os.path.join(cls.tmp.name, "test.box")
+        with open(cls.box, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        with open(cls.box, "rb") as f:
+            cls.checksum = hashlib.sha256(f.read()).hexdigest()
+        cls.server = FakeVagrantCloud(keep_uploads=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        with self.server.lock:
+            self.server.boxes.clear()
+            self.server.content.clear()
+        self.server.add_box("me/box")
+        self.server.add_version("me/box", "1.0")
+        self.server.add_provider("me/box", "1.0", "virtualbox")
+        # Like VagrantCloudClient, the endpoint comes from the environment when none is given
+        patcher = mock.patch.dict(os.environ, {"VAGRANT_CLOUD_API_ENDPOINT": self.server.api_endpoint + "/"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_endpoint_from_environment(self):
+        async with AsyncVagrantCloudApi("token") as api:
+            self.assertEqual(api.API_ENDPOINT, self.server.api_endpoint)
+            self.assertEqual((await api.box("me/box"))["tag"], "me/box")
+            with self.assertRaises(NotFoundError):
+                await api.box("me/missing")
+
+    async def test_create_and_upload(self):
+        async with AsyncVagrantCloudApi("token", self.server.api_endpoint) as api:
+            await api.version_create("me/box", "2.0")
+            for provider, direct in (("virtualbox", False), ("libvirt", True)):
+                with self.subTest(direct=direct):
+                    await api.provider_create("me/box", "2.0", provider)
+                    checksum = await api.provider_upload("me/box", "2.0", provider, self.box, direct=direct)
+                    self.assertEqual(checksum, self.checksum)
+                    uploaded = self.server.provider("me/box", "2.0", provider)
+                    self.assertEqual((uploaded["checksum"], uploaded["hosted"]), (self.checksum, True))
+                    self.assertEqual(len(self.server.content[("me/box", "2.0", provider)]), 64 * 1024)
@@ -0,0 +1,165 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "contrib"))
+sys.path.insert(0, ROOT)
+
+from fake_vagrant_cloud import FakeVagrantCloud  # noqa: E402
+from vagrant_cloud_cli import cli  # noqa: E402
+
+# Every subcommand against the stand-in server: how many HTTP requests it may make. A command
+# must only send the request that does the work, the box is looked up on the 404 path alone.
+REQUEST_COUNTS = [
+    ("validate", 1),
+    ("user me", 1),
+    ("box info me/box", 1),
+    ("box info me/missing", 1),
+    ("box create me new", 1),
+    ("box update me/box -d changed", 1),
+    ("box delete me/box -f", 1),
+    ("box version info me/box 1.0", 1),
+    ("box version info me/box 9.9", 2),
+    ("box version info me/missing 1.0", 2),
+    ("box version create me/box 2.0", 1),
+    ("box version update me/box 1.0 -d changed", 1),
+    ("box version update me/box 9.9 -d changed", 2),
+    ("box version delete me/box 1.0 -f", 1),
+    ("box version release me/box 1.0", 1),
+    ("box version revoke me/box 1.0", 1),
+    ("box version release me/box 9.9", 2),
+    ("box provider info me/box 1.0 virtualbox", 1),
+    ("box provider info me/box 1.0 libvirt", 2),
+    ("box provider create me/box 1.0 libvirt", 1),
+    ("box provider update me/box 1.0 virtualbox -u https://example.com/new.box", 1),
+    ("box provider delete me/box 1.0 virtualbox -f", 1),
+    ("box provider delete me/box 1.0 libvirt -f", 2),
+    # Provider, upload URL, upload, checksum
+    ("box provider upload me/box 1.0 virtualbox {box}", 4),
+    # Provider, direct upload URLs, upload to storage, completion callback, checksum
+    ("box provider upload me/box 1.0 virtualbox {box} --direct", 5),
+    ("box provider download me/box 1.0 virtualbox -o {dir}/download.box", 3),
+    ("box provider upload me/box 1.0 virtualbox {dir}/missing.box", 0),
+    # A missing file is reported before anything is created
+    ("box publish me/box 2.0 virtualbox={dir}/missing.box", 0),
+    # Box, create version, create provider, provider, upload URL, upload, checksum, release
+    ("apply {dir}/apply.json", 8),
+]
+
+# Commands run a second time with nothing changed: only the lookups that show there is nothing to do
+RERUN_COUNTS = [
+    # Provider: the file is already uploaded
+    ("box provider upload me/box 1.0 virtualbox {box}", 1),
+    ("box provider upload me/box 1.0 virtualbox {box} --direct", 1),
+    # Box, provider
+    ("apply {dir}/apply.json", 2),
+]
+
+
+class RequestCountTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.env = {"ATLAS_TOKEN": "test", "XDG_CACHE_HOME": cls.tmp.name, "VAGRANT_CLOUD_CLI_NO_AGENT": "1"}
+        cls.saved_env = {name: os.environ.get(name) for name in cls.env}
+        os.environ.update(cls.env)
+        cls.box = os.path.join(cls.tmp.name, "test.box")
+        with open(cls.box, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        with open(os.path.join(cls.tmp.name, "apply.json"), "w") as f:
+            json.dump({"boxes": [{"tag": "me/box", "versions": [
+                {"version": "2.0", "release": True, "providers": [{"name": "virtualbox", "file": "test.box"}]}]}]}, f)
+        cls.server = FakeVagrantCloud(keep_uploads=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        for name, value in cls.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        cls.tmp.cleanup()
+
+    def seed(self):
+        with self.server.lock:
+            self.server.boxes.clear()
+            self.server.content.clear()
+        self.server.add_box("me/box")
+        self.server.add_version("me/box", "1.0")
+        self.server.add_provider("me/box", "1.0", "virtualbox")
+
+    def run_command(self, command):
+        argv = ["--api-endpoint", self.server.api_endpoint] + command.format(box=self.box, dir=self.tmp.name).split()
+        before = len(self.server.requests)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            cli.run(argv)
+        return self.server.requests[before:]
+
+    def test_request_counts(self):
+        for command, expected in REQUEST_COUNTS:
+            with self.subTest(command=command):
+                self.seed()
+                if "download" in command:
+                    # Something to download
+                    self.run_command("box provider upload me/box 1.0 virtualbox {box} --force")
+                made = self.run_command(command)
+                self.assertEqual(len(made), expected, made)
+
+    def test_rerun_counts(self):
+        for command, expected in RERUN_COUNTS:
+            with self.subTest(command=command):
+                self.seed()
+                self.run_command(command)
+                made = self.run_command(command)
+                self.assertEqual(len(made), expected, made)
+
+    def test_apply_uploads_changed_file(self):
+        self.seed()
+        manifest = os.path.join(self.tmp.name, "manifest.json")
+        box = os.path.join(self.tmp.name, "apply.box")
+        with open(manifest, "w") as f:
+            json.dump({"boxes": [{"tag": "me/box", "versions": [
+                {"version": "2.0", "release": True, "providers": [{"name": "virtualbox", "file": "apply.box"}]}]}]}, f)
+        with open(box, "wb") as f:
+            f.write(os.urandom(1024))
+
+        # Box, create version, create provider, provider, upload URL, upload, checksum, release
+        self.assertEqual(len(self.run_command("apply %s" % manifest)), 8)
+        # Box, provider: the file is unchanged
+        made = self.run_command("apply %s" % manifest)
+        self.assertEqual([method for method, _ in made], ["GET", "GET"], made)
+
+        with open(box, "wb") as f:
+            f.write(os.urandom(1024))
+        # Box, provider, upload URL, upload, checksum
+        made = self.run_command("apply %s" % manifest)
+        self.assertEqual(len(made), 5, made)
+        self.assertEqual(self.server.provider("me/box", "2.0", "virtualbox")["checksum"], sha256(box))
+
+    def test_batch_fetches_per_line(self):
+        script = os.path.join(self.tmp.name, "batch.txt")
+        with open(script, "w") as f:
+            f.write("box info me/box\nbox info me/box\n")
+        for options in ("", "--parallel 2 "):
+            with self.subTest(options=options):
+                self.seed()
+                # A later line sees what changed since an earlier one, like a new invocation would
+                made = self.run_command("batch %s%s" % (options, script))
+                self.assertEqual(made, [("GET", "/api/v1/box/me/box")] * 2)
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+if __name__ == "__main__":
+    unittest.main()
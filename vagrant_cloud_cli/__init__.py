@@ -1,5 +1,34 @@
+import importlib
+
 from vagrant_cloud_cli import cli
 
+# The library API, only imported on first use so that starting the CLI doesn't pay for requests
+_EXPORTS = {
+    "VagrantCloudClient": "client",
+    "VagrantCloudError": "client",
+    "TokenMissingError": "client",
+    "TransportError": "client",
+    "ApiError": "client",
+    "AuthenticationError": "client",
+    "PermissionDeniedError": "client",
+    "NotFoundError": "client",
+    "ValidationError": "client",
+    "RateLimitError": "client",
+    "UploadError": "upload",
+    "DownloadError": "download",
+    "HashIndex": "hashindex",
+    "Box": "models",
+    "Version": "models",
+    "Provider": "models",
+    "User": "models",
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module("vagrant_cloud_cli." + _EXPORTS[name]), name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 
 def main():
     cli.main()
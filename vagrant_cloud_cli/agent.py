@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+
+# Environment the client's command is run with, instead of the agent's own
+FORWARDED_ENV = ("VAGRANT_CLOUD_API_ENDPOINT", "VAGRANT_CLOUD_CLI_CACHE", "XDG_CACHE_HOME",
+                 "VAGRANT_CLOUD_CLI_HASH_INDEX")
+# Commands that read from the terminal or manage the agent itself always run in-process
+LOCAL_COMMANDS = ("agent", "authenticate", "shell", "batch")
+# The agent runs one command at a time, transfers that can take minutes would hold up every
+# other invocation, so they run in-process too
+TRANSFER_COMMANDS = ("upload", "download", "apply", "publish", "mirror")
+
+
+def socket_path():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "vagrant-cloud-cli", "agent.sock")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "vagrant-cloud-cli",
+                        "agent-%d.sock" % os.getuid())
+
+
+def token_hash():
+    token = os.environ.get("ATLAS_TOKEN") or os.environ.get("VAGRANT_CLOUD_TOKEN")
+    return hashlib.sha256(token.encode()).hexdigest() if token else None
+
+
+def _connect(path=None):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path or socket_path())
+    except OSError:
+        s.close()
+        return None
+    return s
+
+
+def _call(s, request):
+    s.sendall((json.dumps(request) + "\n").encode())
+    return s.makefile("r", encoding="utf-8")
+
+
+def should_forward(argv):
+    if os.environ.get("VAGRANT_CLOUD_CLI_NO_AGENT") or not os.path.exists(socket_path()):
+        return False
+    if any(arg in LOCAL_COMMANDS + TRANSFER_COMMANDS for arg in argv):
+        return False
+    if any(arg.startswith("--profile") for arg in argv):
+        return False
+    # Deleting or pruning without --force asks for confirmation on stdin
+    return not ("delete" in argv or "prune" in argv) or "-f" in argv or "--force" in argv
+
+
+def forward(argv):
+    # Runs the command in the agent, streaming its output. Returns the exit code, or None if
+    # there is no agent to take it (or it holds a different token) and it should run in-process.
+    s = _connect()
+    if s is None:
+        return None
+    with s:
+        responses = _call(s, {"command": "run", "argv": argv, "cwd": os.getcwd(), "token_hash": token_hash(),
+                              "env": {name: os.environ.get(name) for name in FORWARDED_ENV},
+                              "isatty": sys.stderr.isatty()})
+        for line in responses:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+                sys.stderr.flush()
+            elif "exit" in message:
+                return message["exit"]
+            elif "error" in message:
+                return None
+    # The command may have been half done, running it again here isn't safe
+    print("Error: Lost the connection to the agent", file=sys.stderr)
+    return 1
+
+
+class _Output:
+    # Stands in for sys.stdout/sys.stderr while a forwarded command runs
+    def __init__(self, wfile, name, isatty):
+        self.wfile = wfile
+        self.name = name
+        self._isatty = isatty
+
+    def write(self, text):
+        if text:
+            self.wfile.write((json.dumps({self.name: text}) + "\n").encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self._isatty
+
+
+def _serve(path):
+    import contextlib
+    import socketserver
+    import threading
+    import traceback
+
+    from vagrant_cloud_cli import cli
+    from vagrant_cloud_cli.client import VagrantCloudError
+    from vagrant_cloud_cli.vcapi import VagrantCloudApi
+
+    class Handler(socketserver.StreamRequestHandler):
+        def _send(self, message):
+            self.wfile.write((json.dumps(message) + "\n").encode())
+
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+            server = self.server
+            if request.get("token_hash") != server.token_hash:
+                return self._send({"error": "The agent was started with a different token"})
+            if request["command"] == "status":
+                return self._send({"pid": os.getpid(), "uptime": time.time() - server.started,
+                                   "commands": server.commands, "endpoint": server.api.API_ENDPOINT})
+            if request["command"] == "stop":
+                self._send({"exit": 0})
+                return threading.Thread(target=server.shutdown).start()
+
+            # One command at a time: they share the working directory, environment and sys.stdout
+            with server.lock:
+                server.commands += 1
+                self._run(request)
+
+        def _run(self, request):
+            saved_env = {name: os.environ.get(name) for name in FORWARDED_ENV}
+            saved_cwd = os.getcwd()
+            stdout = _Output(self.wfile, "stdout", request.get("isatty", False))
+            stderr = _Output(self.wfile, "stderr", request.get("isatty", False))
+            try:
+                for name, value in request["env"].items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+                os.chdir(request["cwd"])
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    try:
+                        code = cli.run(request["argv"], self.server.api)
+                    except SystemExit as e:
+                        code = e.code
+                    except Exception:
+                        traceback.print_exc()
+                        code = 1
+                    if isinstance(code, str):
+                        print(code, file=sys.stderr)
+                        code = 1
+            finally:
+                os.chdir(saved_cwd)
+                for name, value in saved_env.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+            self._send({"exit": code or 0})
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    try:
+        api = VagrantCloudApi(None)
+    except VagrantCloudError as e:
+        print("Error: %s" % e, file=sys.stderr)
+        return 1
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    s = _connect(path)
+    if s is not None:
+        s.close()
+        print("Error: An agent is already listening on '%s'" % path, file=sys.stderr)
+        return 1
+    if os.path.exists(path):
+        os.unlink(path)
+
+    # Only our own user may connect
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(old_umask)
+    print("Agent listening on '%s'" % path, flush=True)
+    server.api = api
+    server.token_hash = token_hash()
+    server.lock = threading.Lock()
+    server.started = time.time()
+    server.commands = 0
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def run(args):
+    return _serve(socket_path())
+
+
+def start(args):
+    import subprocess
+
+    if not token_hash():
+        print("Error: Neither ATLAS_TOKEN or VAGRANT_CLOUD_TOKEN are defined", file=sys.stderr)
+        return 1
+    path = socket_path()
+    s = _connect(path)
+    if s is not None:
+        s.close()
+        print("Agent is already running on '%s'" % path)
+        return
+    proc = subprocess.Popen([sys.executable, "-c", "from vagrant_cloud_cli import main; main()", "agent", "run"],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            print("Error: The agent exited with code %d" % proc.returncode)
+            return 1
+        s = _connect(path)
+        if s is not None:
+            s.close()
+            print("Agent started (pid %d) on '%s'" % (proc.pid, path))
+            return
+        time.sleep(0.05)
+    print("Error: The agent didn't start listening on '%s'" % path)
+    return 1
+
+
+def _request(command):
+    s = _connect()
+    if s is None:
+        return None
+    try:
+        with s:
+            line = _call(s, {"command": command, "token_hash": token_hash()}).readline()
+    except OSError:
+        # Shutting down
+        return None
+    return json.loads(line) if line else None
+
+
+def stop(args):
+    response = _request("stop")
+    if response is None:
+        print("Agent is not running")
+        return 1
+    if "error" in response:
+        print("Error: %s" % response["error"])
+        return 1
+    deadline = time.monotonic() + 10
+    while os.path.exists(socket_path()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    print("Agent stopped")
+
+
+def status(args):
+    response = _request("status")
+    if response is None:
+        print("Agent is not running")
+        return 1
+    if "error" in response:
+        print("Error: %s" % response["error"])
+        return 1
+    print("Agent running (pid %d) on '%s'" % (response["pid"], socket_path()))
+    print("Uptime: %ds" % response["uptime"])
+    print("Commands run: %d" % response["commands"])
+    print("API endpoint: %s" % response["endpoint"])
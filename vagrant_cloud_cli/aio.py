@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import os
+
+from vagrant_cloud_cli.client import API_ENDPOINT, ApiError, api_error  # noqa: F401
+from vagrant_cloud_cli.upload import DEFAULT_CHUNK_SIZE
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncVagrantCloudApi:
+    # asyncio counterpart of VagrantCloudClient for driving many calls from one event loop. Methods
+    # take plain arguments, return the decoded JSON documents and raise the same ApiError
+    # subclasses. At most `concurrency` requests (uploads included) are in flight at once.
+    def __init__(self, token, endpoint=None, concurrency=16):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for AsyncVagrantCloudApi, install vagrant_cloud_cli[async]")
+        # The same endpoint VagrantCloudClient would use
+        self.API_ENDPOINT = (endpoint or os.environ.get("VAGRANT_CLOUD_API_ENDPOINT", API_ENDPOINT)).rstrip("/")
+        self.headers = {"Authorization": "Bearer %s" % token}
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.s = None
+
+    async def __aenter__(self):
+        self.s = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.s is not None:
+            await self.s.close()
+            self.s = None
+
+    async def _check(self, r):
+        if r.status < 400:
+            return await r.json(content_type=None)
+        try:
+            errors = (await r.json(content_type=None))["errors"]
+        except (ValueError, KeyError, TypeError):
+            errors = [r.reason or ""]
+        raise api_error(r.status, errors)
+
+    async def _request(self, method, page, data=None):
+        async with self.semaphore:
+            async with self.s.request(method, self.API_ENDPOINT + page, json=data, headers=self.headers) as r:
+                return await self._check(r)
+
+    async def _get(self, page):
+        return await self._request("GET", page)
+
+    async def _post(self, page, data):
+        return await self._request("POST", page, data)
+
+    async def _put(self, page, data={}):
+        return await self._request("PUT", page, data)
+
+    async def _delete(self, page):
+        return await self._request("DELETE", page)
+
+    async def user(self, username):
+        return await self._get("/user/" + username)
+
+    async def box(self, tag):
+        return await self._get("/box/" + tag)
+
+    async def box_create(self, username, name, description=None, private=False):
+        return await self._post("/boxes", {"box": {"username": username, "name": name,
+                                                   "short_description": description, "is_private": private}})
+
+    async def box_update(self, tag, name=None, description=None, private=None):
+        data = {}
+        if name:
+            data["name"] = name
+        if description is not None:
+            data["short_description"] = description
+        if private is not None:
+            data["is_private"] = private
+        return await self._put("/box/" + tag, {"box": data})
+
+    async def box_delete(self, tag):
+        return await self._delete("/box/" + tag)
+
+    async def version(self, tag, version):
+        return await self._get("/box/" + tag + "/version/" + version)
+
+    async def version_create(self, tag, version, description=None):
+        return await self._post("/box/" + tag + "/versions",
+                                {"version": {"version": version, "description": description}})
+
+    async def version_update(self, tag, version, new_version=None, description=None):
+        data = {}
+        if new_version:
+            data["version"] = new_version
+        if description is not None:
+            data["description"] = description
+        return await self._put("/box/" + tag + "/version/" + version, {"version": data})
+
+    async def version_delete(self, tag, version):
+        return await self._delete("/box/" + tag + "/version/" + version)
+
+    async def version_release(self, tag, version):
+        return await self._put("/box/" + tag + "/version/" + version + "/release")
+
+    async def version_revoke(self, tag, version):
+        return await self._put("/box/" + tag + "/version/" + version + "/revoke")
+
+    async def provider(self, tag, version, provider):
+        return await self._get("/box/" + tag + "/version/" + version + "/provider/" + provider)
+
+    async def provider_create(self, tag, version, provider, url=None, checksum=None, checksum_type="sha256"):
+        data = {"name": provider, "url": url}
+        if checksum:
+            data.update({"checksum": checksum, "checksum_type": checksum_type})
+        return await self._post("/box/" + tag + "/version/" + version + "/providers", {"provider": data})
+
+    async def provider_update(self, tag, version, provider, name=None, url=None, checksum=None,
+                              checksum_type="sha256"):
+        data = {}
+        if name:
+            data["name"] = name
+        if url:
+            data["url"] = url
+        if checksum:
+            data.update({"checksum": checksum, "checksum_type": checksum_type})
+        return await self._put("/box/" + tag + "/version/" + version + "/provider/" + provider, {"provider": data})
+
+    async def provider_delete(self, tag, version, provider):
+        return await self._delete("/box/" + tag + "/version/" + version + "/provider/" + provider)
+
+    async def _stream(self, f, chunk_size, hash):
+        # File reads happen in the default executor so a multi-GB upload doesn't block the loop
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await loop.run_in_executor(None, f.read, chunk_size)
+            if not data:
+                break
+            if hash:
+                hash.update(data)
+            yield data
+
+    async def provider_upload(self, tag, version, provider, file, chunk_size=DEFAULT_CHUNK_SIZE,
+                              checksum_type="sha256", direct=False):
+        # Returns the checksum computed while uploading (None if checksum_type is None)
+        provider_path = "/box/" + tag + "/version/" + version + "/provider/" + provider
+        data = await self._get(provider_path + ("/upload/direct" if direct else "/upload"))
+        hash = hashlib.new(checksum_type) if checksum_type else None
+        headers = {"Content-Length": str(os.path.getsize(file))}
+        if not direct:
+            # upload_path is a pre-signed object storage URL in direct mode, it must not be sent our API token
+            headers.update(self.headers)
+        async with self.semaphore:
+            with open(file, "rb") as f:
+                async with self.s.put(data["upload_path"], data=self._stream(f, chunk_size, hash),
+                                      headers=headers) as r:
+                    await self._check(r)
+            if direct:
+                async with self.s.put(data["callback"], headers=self.headers) as r:
+                    await self._check(r)
+        if hash:
+            await self._put(provider_path, {"provider": {"checksum": hash.hexdigest(),
+                                                         "checksum_type": checksum_type}})
+            return hash.hexdigest()
@@ -0,0 +1,282 @@
+import contextlib
+import io
+import shlex
+import sys
+import threading
+
+from vagrant_cloud_cli.cli import build_parser
+from vagrant_cloud_cli.executor import Executor
+from vagrant_cloud_cli.client import is_glob
+from vagrant_cloud_cli.vcapi import error_message
+
+# Global options that configure the shared session, a command can't change them for itself
+SESSION_OPTIONS = ["cache", "cache_ttl", "rate_limit", "max_retries", "api_endpoint", "trace", "trace_file",
+                   "profile", "profile_output"]
+# Commands that can't be run from inside a shell or batch
+NESTED_COMMANDS = ("shell", "batch", "agent", "authenticate")
+PROMPT = "vagrant-cloud-cli> "
+
+
+class BatchError(Exception):
+    pass
+
+
+class _Failed(Exception):
+    def __init__(self, result):
+        super().__init__("exit code %d" % result[0])
+        self.result = result
+
+
+class _ThreadOutput:
+    # Stands in for sys.stdout/sys.stderr while commands run in parallel, so that each command's
+    # output is collected on its own and printed in one piece once it has finished
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def _target(self):
+        buffer = getattr(self.local, "buffer", None)
+        return self.stream if buffer is None else buffer
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self):
+        return self._target() is self.stream and self.stream.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _split(line):
+    if line.lstrip().startswith("#"):
+        return []
+    try:
+        return shlex.split(line)
+    except ValueError as e:
+        raise BatchError(str(e))
+
+
+def _parse(parser, argv):
+    # Usage errors are reported in one line instead of followed by the whole help text. Returns
+    # None for --help, which has been printed.
+    out = io.StringIO()
+    err = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            return parser.parse_args(argv)
+    except SystemExit as e:
+        if e.code:
+            raise BatchError(err.getvalue().strip().partition("error: ")[2] or "invalid command")
+        sys.stdout.write(out.getvalue())
+        return None
+
+
+def _check(parser, args, name):
+    if args.command in NESTED_COMMANDS:
+        raise BatchError("'%s' can't be run from %s" % (args.command, name))
+    for option in SESSION_OPTIONS:
+        if getattr(args, option) != parser.get_default(option):
+            raise BatchError("--%s applies to the whole session, give it before '%s'" %
+                             (option.replace("_", "-"), name))
+
+
+def _session_parser(api, args):
+    # Every command is parsed with the full tree, with the options the session was started
+    # with as the defaults (so e.g. `--format json batch` applies to every line)
+    parser = build_parser()
+    parser.set_defaults(**{option: getattr(args, option) for option in SESSION_OPTIONS + ["format"]})
+    api.parser = parser
+    return parser
+
+
+def _reset(api):
+    # Each line starts with nothing fetched, like a new invocation. The options the session was
+    # started with and the connection pool are kept.
+    endpoint, disk_cache = api.API_ENDPOINT, api.disk_cache
+    api.reset()
+    api.API_ENDPOINT, api.disk_cache = endpoint, disk_cache
+
+
+def _call(api, args):
+    try:
+        return getattr(api, args.func)(args) or 0
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            print(e.code, file=sys.stderr)
+            return 1
+        return e.code or 0
+    except Exception as e:
+        print("Error: %s" % error_message(e), file=sys.stderr)
+        return 1
+
+
+def _key(args):
+    # Lines for the same box must run in the order given. Lines that don't name one box (user,
+    # validate, apply, renames) are ordered against every other line.
+    if getattr(args, "name", None):
+        return None
+    tag = getattr(args, "tag", None)
+    tags = getattr(args, "tags", None)
+    if tags and len(tags) == 1 and not is_glob(tags[0]):
+        tag = tags[0]
+    if tag is None and args.func == "box_create":
+        tag = "%s/%s" % (args.username, args.box)
+    return tag.lower() if tag else None
+
+
+def shell(api, args):
+    parser = _session_parser(api, args)
+    try:
+        # Line editing and history for input()
+        import readline  # noqa: F401
+    except ImportError:
+        pass
+
+    prompt = PROMPT if sys.stdin.isatty() else ""
+    code = 0
+    while True:
+        try:
+            line = input(prompt)
+        except EOFError:
+            if prompt:
+                print()
+            return code
+        except KeyboardInterrupt:
+            print()
+            continue
+
+        try:
+            argv = _split(line)
+            if not argv:
+                continue
+            if argv[0] in ("exit", "quit"):
+                return code
+            if argv[0] == "help":
+                argv = argv[1:] + ["--help"]
+            command = _parse(parser, argv)
+            if command is None:
+                continue
+            _check(parser, command, "shell")
+            _reset(api)
+            code = _call(api, command)
+        except BatchError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            code = 2
+        except KeyboardInterrupt:
+            print("Interrupted", file=sys.stderr)
+            code = 130
+
+
+def batch(api, args):
+    parser = _session_parser(api, args)
+    if args.file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        try:
+            with open(args.file) as f:
+                lines = f.read().splitlines()
+        except OSError as e:
+            print("Error: Can't read '%s': %s" % (args.file, e.strerror))
+            return 1
+
+    # Every line is checked before anything runs, a typo on line 150 shouldn't leave the first
+    # 149 done
+    commands = []
+    invalid = 0
+    for lineno, line in enumerate(lines, 1):
+        try:
+            argv = _split(line)
+            if not argv:
+                continue
+            command = _parse(parser, argv)
+            if command is None:
+                continue
+            _check(parser, command, "batch")
+            if command.func.endswith(("_delete", "_prune")) and not command.force:
+                raise BatchError("%s needs --force in a batch, there is no one to confirm it" % command.action)
+        except BatchError as e:
+            print("Error: line %d: %s" % (lineno, e), file=sys.stderr)
+            invalid += 1
+            continue
+        commands.append(("line %d: %s" % (lineno, line.strip()), command))
+    if invalid:
+        print("Error: %d invalid lines, nothing was run" % invalid, file=sys.stderr)
+        return 1
+
+    parallel = args.parallel > 1
+    stdout = _ThreadOutput(sys.stdout)
+    stderr = _ThreadOutput(sys.stderr)
+
+    def task(command):
+        def run():
+            out = err = None
+            if parallel:
+                out = stdout.local.buffer = io.StringIO()
+                err = stderr.local.buffer = io.StringIO()
+            else:
+                _reset(api)
+                api.show_progress = True
+            try:
+                result = (_call(api, command), out, err)
+            finally:
+                stdout.local.buffer = stderr.local.buffer = None
+            if result[0] and args.stop_on_error:
+                raise _Failed(result)
+            return result
+        return run
+
+    failed = []
+
+    def report(task):
+        if task.state == "skipped":
+            print("Skipped %s (an earlier line failed)" % task.name, file=sys.stderr)
+            return
+        if task.state == "failed" and not isinstance(task.error, _Failed):
+            failed.append(task)
+            print("Error: %s: %s" % (task.name, error_message(task.error)), file=sys.stderr)
+            return
+        code, out, err = task.result if task.state == "done" else task.error.result
+        if out is not None:
+            stdout.stream.write(out.getvalue())
+            stderr.stream.write(err.getvalue())
+            stdout.stream.flush()
+        if code:
+            failed.append(task)
+            print("Error: %s exited with %d" % (task.name, code), file=sys.stderr)
+
+    executor = Executor(args.parallel, report)
+    previous = barrier = None
+    since_barrier = []
+    last = {}
+    for name, command in commands:
+        if not parallel:
+            previous = executor.add(name, task(command), [previous])
+            continue
+        key = _key(command)
+        if key is None:
+            barrier = executor.add(name, task(command), since_barrier + [barrier])
+            since_barrier = []
+            last = {}
+        else:
+            last[key] = executor.add(name, task(command), [last.get(key), barrier])
+            since_barrier.append(last[key])
+
+    if parallel:
+        api._set_concurrency(args.parallel)
+        # Lines running at the same time share the client and can't each get their own memo, a
+        # GET memoized for one would be stale for the lines after it, so none is kept
+        api._responses = None
+        sys.stdout, sys.stderr = stdout, stderr
+    try:
+        counts = executor.run()
+    finally:
+        sys.stdout, sys.stderr = stdout.stream, stderr.stream
+    skipped = counts.get("skipped", 0)
+    print("%d commands: %d succeeded, %d failed, %d skipped" %
+          (len(commands), len(commands) - len(failed) - skipped, len(failed), skipped), file=sys.stderr)
+    if failed or skipped:
+        return 1
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir():
+    # Looked up on every use, the agent runs each command with its client's $XDG_CACHE_HOME
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "vagrant-cloud-cli",
+                        "http")
+
+
+class DiskCache:
+    # One JSON file per (token, URL). Entries younger than ttl are served without a request,
+    # older ones are revalidated with If-None-Match/If-Modified-Since. File mtimes are bumped on
+    # every hit so eviction can drop the least recently used entries first.
+    def __init__(self, token, path=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.token_hash = hashlib.sha256(token.encode()).hexdigest()
+        self.path = path or default_cache_dir()
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def _file(self, url):
+        key = hashlib.sha256(("%s\0%s" % (self.token_hash, url)).encode()).hexdigest()
+        return os.path.join(self.path, key + ".json")
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, os.path.join(self.path, name)))
+        return entries
+
+    def get(self, url):
+        file = self._file(url)
+        try:
+            with open(file) as f:
+                entry = json.load(f)
+            os.utime(file)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def validators(self, entry):
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def response(self, entry):
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+
+        r = Response()
+        r.status_code = 200
+        r.url = entry["url"]
+        r.headers = CaseInsensitiveDict(entry["headers"])
+        r.encoding = "utf-8"
+        r._content = entry["body"].encode("utf-8")
+        return r
+
+    def _write(self, url, entry):
+        file = self._file(url)
+        tmp = "%s.%d.tmp" % (file, os.getpid())
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, file)
+        except OSError:
+            return
+        self._evict()
+
+    def store(self, url, r):
+        headers = {name: r.headers[name] for name in ("Content-Type", "ETag", "Last-Modified") if name in r.headers}
+        self._write(url, {"url": url, "stored_at": time.time(), "headers": headers,
+                          "body": r.content.decode("utf-8")})
+
+    def refresh(self, url, entry):
+        entry["stored_at"] = time.time()
+        self._write(url, entry)
+
+    def invalidate(self, url):
+        try:
+            os.remove(self._file(url))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        entries = self._entries()
+        for _, _, file in entries:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        return len(entries)
+
+    def stats(self):
+        entries = self._entries()
+        now = time.time()
+        return {
+            "path": self.path,
+            "entries": len(entries),
+            "size": sum(size for _, size, _ in entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "oldest_access": max((now - mtime for mtime, _, _ in entries), default=None),
+        }
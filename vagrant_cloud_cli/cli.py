@@ -1,38 +1,24 @@
 #!/usr/bin/python3
 import argparse
+import os
 import sys
 
-from vagrant_cloud_cli.vcapi import VagrantCloudApi
+from vagrant_cloud_cli.cache import DEFAULT_TTL
+from vagrant_cloud_cli.output import FORMATS
+
+PROFILE_MODES = ["cpu", "mem"]
 
 
 class MyArgumentParser(argparse.ArgumentParser):
     def error(self, message):
         sys.stderr.write('error: %s\n' % message)
         self.print_help()
-        exit(2)
-
-
-def main():
-    parser = MyArgumentParser(description="API token must be set in either the 'ATLAS_TOKEN' or "
-                                          "'VAGRANT_CLOUD_TOKEN' environment variable")
-    VC = VagrantCloudApi(parser)
-    subparsers = parser.add_subparsers(title="Commands", dest="command")
-    subparsers.required = True
-
-    # Authenticate
-    parser_validate = subparsers.add_parser("authenticate", help="Get an API token")
-    parser_validate.set_defaults(func=VC.authenticate)
-
-    # Validate
-    parser_validate = subparsers.add_parser("validate", help="Validate API token")
-    parser_validate.set_defaults(func=VC.validate)
+        sys.exit(2)
 
-    parser_user = subparsers.add_parser("user", help="Get information about a user")
-    parser_user.add_argument("username")
-    parser_user.set_defaults(func=VC.user)
 
-    # Box Management
-    parser_box = subparsers.add_parser("box", help="Box actions")
+def build_box(parser_box):
+    from vagrant_cloud_cli.prune import count, duration
+    from vagrant_cloud_cli.upload import CHECKSUM_TYPES
 
     # Actions for Boxes
     subparsers_box = parser_box.add_subparsers(title="Actions", dest="action")
@@ -41,7 +27,7 @@ def main():
     # Box Info
     parser_box_info = subparsers_box.add_parser("info", help="Get information about a box")
     parser_box_info.add_argument("tag", help="Box tag in the format 'myuser/test'")
-    parser_box_info.set_defaults(func=VC.box_info)
+    parser_box_info.set_defaults(func="box_info")
 
     # Box Create
     parser_box_create = subparsers_box.add_parser("create", help="Create a box")
@@ -50,7 +36,7 @@ def main():
     parser_box_create.add_argument("-d", "--description", type=str, help="A short summary of the box")
     parser_box_create.add_argument("-p", "--private", default=False, action="store_true",
                                    help="Whether or not this box is private (default is public)")
-    parser_box_create.set_defaults(func=VC.box_create)
+    parser_box_create.set_defaults(func="box_create")
 
     # Box Update
     parser_box_update = subparsers_box.add_parser("update", help="Update a box")
@@ -61,13 +47,37 @@ def main():
                                    help="Whether or not this box is private")
     parser_box_update.add_argument("-u", "--public", default=None, action="store_true",
                                    help="Whether or not this box is public")
-    parser_box_update.set_defaults(func=VC.box_update)
+    parser_box_update.set_defaults(func="box_update")
 
     # Box Delete
     parser_box_delete = subparsers_box.add_parser("delete", help="Delete a box")
     parser_box_delete.add_argument("tag", help="Box tag for the box to delete in the format 'myuser/test'")
     parser_box_delete.add_argument("-f", "--force", action="store_true", help="Don't prompt for confirmation")
-    parser_box_delete.set_defaults(func=VC.box_delete)
+    parser_box_delete.set_defaults(func="box_delete")
+
+    # Box Publish
+    parser_box_publish = subparsers_box.add_parser("publish", help="Create a version and its providers, upload the "
+                                                                   "boxes in parallel and release it")
+    parser_box_publish.add_argument("tag", help="Box tag in the format 'myuser/test'")
+    parser_box_publish.add_argument("version", help="Box version to publish")
+    parser_box_publish.add_argument("providers", nargs="+", metavar="provider=file",
+                                    help="Provider name and the box file to upload for it, or a URL to download it "
+                                         "from")
+    parser_box_publish.add_argument("-d", "--description", type=str,
+                                    help="A description for this version. Can be formatted with Markdown")
+    parser_box_publish.add_argument("-j", "--jobs", type=int, default=4, help="Operations to run at once (default 4)")
+    parser_box_publish.add_argument("-n", "--dry-run", action="store_true",
+                                    help="Only show the operations that would run")
+    parser_box_publish.add_argument("-c", "--chunk-size", type=int, default=1, metavar="MiB",
+                                    help="Size of each read/socket write while uploading (default 1 MiB)")
+    parser_box_publish.add_argument("--checksum-type", type=str, choices=CHECKSUM_TYPES, default="sha256",
+                                    help="Checksum computed while uploading and set on each provider (default sha256)")
+    parser_box_publish.add_argument("--direct", action="store_true",
+                                    help="Upload straight to Vagrant Cloud's object storage")
+    parser_box_publish.add_argument("-f", "--force-upload", action="store_true",
+                                    help="Upload every file provider even if it is already hosted")
+    parser_box_publish.add_argument("--no-release", action="store_true", help="Don't release the version")
+    parser_box_publish.set_defaults(func="box_publish")
 
     # Box Version Actions
     parser_box_version = subparsers_box.add_parser("version", help="Get version information about a box")
@@ -78,7 +88,7 @@ def main():
     parser_box_version_info = subparsers_box_version.add_parser("info", help="Get version information for a box")
     parser_box_version_info.add_argument("tag", help="Box tag for the box in the format 'myuser/test'")
     parser_box_version_info.add_argument("version", help="Box version")
-    parser_box_version_info.set_defaults(func=VC.box_version_info)
+    parser_box_version_info.set_defaults(func="box_version_info")
 
     # Box Version Create
     parser_box_version_create = subparsers_box_version.add_parser("create", help="Create a new version for a box")
@@ -86,7 +96,7 @@ def main():
     parser_box_version_create.add_argument("version", help="Box version to create")
     parser_box_version_create.add_argument("-d", "--description", type=str,
                                            help="A description for this version. Can be formatted with Markdown")
-    parser_box_version_create.set_defaults(func=VC.box_version_create)
+    parser_box_version_create.set_defaults(func="box_version_create")
 
     # Box Version Update
     parser_box_version_update = subparsers_box_version.add_parser("update", help="Update an existing version of a box")
@@ -96,26 +106,57 @@ def main():
                                            help="The version number of this version")
     parser_box_version_update.add_argument("-d", "--description", type=str,
                                            help="A description for this version. Can be formatted with Markdown")
-    parser_box_version_update.set_defaults(func=VC.box_version_update)
+    parser_box_version_update.set_defaults(func="box_version_update")
 
     # Box Version Delete
     parser_box_version_delete = subparsers_box_version.add_parser("delete", help="Delete a version of a box")
-    parser_box_version_delete.add_argument("tag", help="Box tag in the format 'myuser/test'")
+    parser_box_version_delete.add_argument("tags", nargs="+", metavar="tag",
+                                           help="Box tag in the format 'myuser/test', or a glob on the box name like "
+                                                "'myuser/*'. Several boxes are handled in parallel")
     parser_box_version_delete.add_argument("version", help="Version to delete")
     parser_box_version_delete.add_argument("-f", "--force", action="store_true", help="Don't prompt for confirmation")
-    parser_box_version_delete.set_defaults(func=VC.box_version_delete)
+    parser_box_version_delete.add_argument("-j", "--jobs", type=int, default=4,
+                                           help="Boxes to handle at once (default 4)")
+    parser_box_version_delete.set_defaults(func="box_version_delete")
 
     # Box Version Release
     parser_box_version_release = subparsers_box_version.add_parser("release", help="Release a version of a box")
-    parser_box_version_release.add_argument("tag", help="Box tag for the box in the format 'myuser/test'")
+    parser_box_version_release.add_argument("tags", nargs="+", metavar="tag",
+                                            help="Box tag in the format 'myuser/test', or a glob on the box name like "
+                                                 "'myuser/*'. Several boxes are handled in parallel")
     parser_box_version_release.add_argument("version", help="Box version to release")
-    parser_box_version_release.set_defaults(func=VC.box_version_release)
+    parser_box_version_release.add_argument("-j", "--jobs", type=int, default=4,
+                                            help="Boxes to handle at once (default 4)")
+    parser_box_version_release.set_defaults(func="box_version_release")
 
     # Box Version Revoke
     parser_box_version_revoke = subparsers_box_version.add_parser("revoke", help="Revoke a version of a box")
-    parser_box_version_revoke.add_argument("tag", help="Box tag for the box in the format 'myuser/test'")
+    parser_box_version_revoke.add_argument("tags", nargs="+", metavar="tag",
+                                            help="Box tag in the format 'myuser/test', or a glob on the box name like "
+                                                 "'myuser/*'. Several boxes are handled in parallel")
     parser_box_version_revoke.add_argument("version", help="Box version to revoke")
-    parser_box_version_revoke.set_defaults(func=VC.box_version_revoke)
+    parser_box_version_revoke.add_argument("-j", "--jobs", type=int, default=4,
+                                            help="Boxes to handle at once (default 4)")
+    parser_box_version_revoke.set_defaults(func="box_version_revoke")
+
+    # Box Version Prune
+    parser_box_version_prune = subparsers_box_version.add_parser("prune", help="Delete old versions of one or more "
+                                                                               "boxes")
+    parser_box_version_prune.add_argument("tags", nargs="+", metavar="tag",
+                                          help="Box tag in the format 'myuser/test', or a glob on the box name like "
+                                               "'myuser/*' for all of a user's boxes")
+    parser_box_version_prune.add_argument("--keep-last", type=count, metavar="N",
+                                          help="Keep the N most recently created versions of each box")
+    parser_box_version_prune.add_argument("--older-than", type=duration, metavar="AGE",
+                                          help="Only delete versions created more than AGE ago (e.g. 30d, 12h, 2w)")
+    parser_box_version_prune.add_argument("--keep-released", action="store_true",
+                                          help="Never delete released versions")
+    parser_box_version_prune.add_argument("-j", "--jobs", type=int, default=4,
+                                          help="Deletions to run at once (default 4)")
+    parser_box_version_prune.add_argument("-n", "--dry-run", action="store_true",
+                                          help="Only show the versions that would be deleted")
+    parser_box_version_prune.add_argument("-f", "--force", action="store_true", help="Don't prompt for confirmation")
+    parser_box_version_prune.set_defaults(func="box_version_prune")
 
     # Box Provider Actions
     parser_box_provider = subparsers_box.add_parser("provider", help="Get provider information about a box")
@@ -127,7 +168,7 @@ def main():
     parser_box_provider_info.add_argument("tag", help="Box tag for the box in the format 'myuser/test'")
     parser_box_provider_info.add_argument("version", help="Box version")
     parser_box_provider_info.add_argument("provider", help="Provider to get information about")
-    parser_box_provider_info.set_defaults(func=VC.box_provider_info)
+    parser_box_provider_info.set_defaults(func="box_provider_info")
 
     # Box Provider Create
     parser_box_provider_create = subparsers_box_provider.add_parser("create", help="Create a new provider for a box")
@@ -136,7 +177,10 @@ def main():
     parser_box_provider_create.add_argument("provider", help="The name of the provider")
     parser_box_provider_create.add_argument("-u", "--url", type=str,
                                             help="A valid URL to download this provider. If omitted, you must upload the Vagrant box image for this provider to Vagrant Cloud before the provider can be used")
-    parser_box_provider_create.set_defaults(func=VC.box_provider_create)
+    parser_box_provider_create.add_argument("--checksum", type=str, help="Checksum of the box for this provider")
+    parser_box_provider_create.add_argument("--checksum-type", type=str, choices=CHECKSUM_TYPES, default="sha256",
+                                            help="Type of the checksum (default sha256)")
+    parser_box_provider_create.set_defaults(func="box_provider_create")
 
     # Box Provider Update
     parser_box_provider_update = subparsers_box_provider.add_parser("update", help="Update an existing version of a box")
@@ -147,7 +191,10 @@ def main():
                                             help="The name of the provider")
     parser_box_provider_update.add_argument("-u", "--url", type=str,
                                             help="A valid URL to download this provider. If omitted, you must upload the Vagrant box image for this provider to Vagrant Cloud before the provider can be used")
-    parser_box_provider_update.set_defaults(func=VC.box_provider_update)
+    parser_box_provider_update.add_argument("--checksum", type=str, help="Checksum of the box for this provider")
+    parser_box_provider_update.add_argument("--checksum-type", type=str, choices=CHECKSUM_TYPES, default="sha256",
+                                            help="Type of the checksum (default sha256)")
+    parser_box_provider_update.set_defaults(func="box_provider_update")
 
     # Box Provider Delete
     parser_box_provider_delete = subparsers_box_provider.add_parser("delete", help="Delete a version of a box")
@@ -155,7 +202,7 @@ def main():
     parser_box_provider_delete.add_argument("version", help="Box version")
     parser_box_provider_delete.add_argument("provider", help="Provider to delete")
     parser_box_provider_delete.add_argument("-f", "--force", action="store_true", help="Don't prompt for confirmation")
-    parser_box_provider_delete.set_defaults(func=VC.box_provider_delete)
+    parser_box_provider_delete.set_defaults(func="box_provider_delete")
 
     # Box Provider Upload
     parser_box_provider_upload = subparsers_box_provider.add_parser("upload", help="Upload a box for a provider")
@@ -163,11 +210,252 @@ def main():
     parser_box_provider_upload.add_argument("version", help="Box version")
     parser_box_provider_upload.add_argument("provider", help="Box provider to upload")
     parser_box_provider_upload.add_argument("file", help="Path to the box to upload")
-    parser_box_provider_upload.set_defaults(func=VC.box_provider_upload)
+    parser_box_provider_upload.add_argument("-c", "--chunk-size", type=int, default=1, metavar="MiB",
+                                            help="Size of each read/socket write while uploading (default 1 MiB)")
+    parser_box_provider_upload.add_argument("-f", "--force", action="store_true",
+                                            help="Upload even if the upload journal shows this file was already "
+                                                 "uploaded to this provider")
+    parser_box_provider_upload.add_argument("--checksum-type", type=str, choices=CHECKSUM_TYPES + ["none"],
+                                            default="sha256",
+                                            help="Checksum computed while uploading and set on the provider "
+                                                 "(default sha256)")
+    parser_box_provider_upload.add_argument("-d", "--direct", action="store_true",
+                                            help="Upload straight to Vagrant Cloud's object storage instead of "
+                                                 "through the API upload proxy")
+    parser_box_provider_upload.add_argument("--no-mmap", action="store_true",
+                                            help="Read the box with ordinary buffered reads instead of "
+                                                 "memory-mapping it")
+    parser_box_provider_upload.set_defaults(func="box_provider_upload")
+
+    # Box Provider Download
+    parser_box_provider_download = subparsers_box_provider.add_parser("download", help="Download the box of a "
+                                                                                     "provider")
+    parser_box_provider_download.add_argument("tag", help="Box tag for the box in the format 'myuser/test'")
+    parser_box_provider_download.add_argument("version", help="Box version")
+    parser_box_provider_download.add_argument("provider", help="Box provider to download")
+    parser_box_provider_download.add_argument("-o", "--output", metavar="FILE",
+                                              help="Where to save the box (default <user>-<box>-<version>-"
+                                                   "<provider>.box). An interrupted download is resumed from "
+                                                   "FILE.part")
+    parser_box_provider_download.add_argument("-j", "--jobs", type=int, default=8,
+                                              help="Range requests to run at once (default 8)")
+    parser_box_provider_download.add_argument("-s", "--segment-size", type=int, default=16, metavar="MiB",
+                                              help="Size of each Range request (default 16 MiB)")
+    parser_box_provider_download.add_argument("--no-verify", action="store_true",
+                                              help="Don't verify the checksum set on the provider")
+    parser_box_provider_download.add_argument("-f", "--force", action="store_true",
+                                              help="Overwrite FILE if it exists")
+    parser_box_provider_download.set_defaults(func="box_provider_download")
+
+
+def build_apply(parser_apply):
+    parser_apply.add_argument("manifest", help="Path to a JSON or YAML manifest")
+    parser_apply.add_argument("-j", "--jobs", type=int, default=4, help="Operations to run at once (default 4)")
+    parser_apply.add_argument("-n", "--dry-run", action="store_true", help="Only show the operations that would run")
+    parser_apply.add_argument("-c", "--chunk-size", type=int, default=1, metavar="MiB",
+                              help="Size of each read/socket write while uploading (default 1 MiB)")
+    parser_apply.add_argument("-d", "--direct", action="store_true",
+                              help="Upload straight to Vagrant Cloud's object storage")
+    parser_apply.add_argument("-f", "--force-upload", action="store_true",
+                              help="Upload every file provider even if it is already hosted")
+    parser_apply.set_defaults(func="apply")
+
+
+def build_cache(parser_cache):
+    subparsers_cache = parser_cache.add_subparsers(title="Actions", dest="action")
+    subparsers_cache.required = True
+
+    parser_cache_clear = subparsers_cache.add_parser("clear", help="Remove all cached responses")
+    parser_cache_clear.set_defaults(func="cache_clear")
+
+    parser_cache_stats = subparsers_cache.add_parser("stats", help="Show cache usage")
+    parser_cache_stats.set_defaults(func="cache_stats")
+
+
+def build_agent(parser_agent):
+    from vagrant_cloud_cli import agent
+
+    subparsers_agent = parser_agent.add_subparsers(title="Actions", dest="action")
+    subparsers_agent.required = True
+
+    parser_agent_start = subparsers_agent.add_parser("start", help="Start the agent in the background")
+    parser_agent_start.set_defaults(func=agent.start)
+
+    parser_agent_run = subparsers_agent.add_parser("run", help="Run the agent in the foreground")
+    parser_agent_run.set_defaults(func=agent.run)
+
+    parser_agent_stop = subparsers_agent.add_parser("stop", help="Stop the agent")
+    parser_agent_stop.set_defaults(func=agent.stop)
+
+    parser_agent_status = subparsers_agent.add_parser("status", help="Show whether the agent is running")
+    parser_agent_status.set_defaults(func=agent.status)
+
+
+# Commands with big argument trees, only built when they appear on the command line
+LAZY_COMMANDS = [
+    ("box", "Box actions", build_box),
+    ("apply", "Create, update, upload and release everything described in a manifest", build_apply),
+    ("cache", "Manage the on-disk response cache", build_cache),
+    ("agent", "Keep a warm API session in a background agent that other invocations hand their commands to "
+              "(set VAGRANT_CLOUD_CLI_NO_AGENT to bypass it)", build_agent),
+]
+
+
+def build_parser(argv=None):
+    # With argv, only the subcommands named in it get their arguments, the rest just show up in --help
+    parser = MyArgumentParser(description="API token must be set in either the 'ATLAS_TOKEN' or "
+                                          "'VAGRANT_CLOUD_TOKEN' environment variable")
+    parser.add_argument("--cache", action="store_true", default=bool(os.environ.get("VAGRANT_CLOUD_CLI_CACHE")),
+                        help="Cache API responses on disk and revalidate them with conditional requests "
+                             "(or set VAGRANT_CLOUD_CLI_CACHE)")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_TTL, metavar="SECONDS",
+                        help="Serve cached responses younger than this without a request (default %d)" % DEFAULT_TTL)
+    parser.add_argument("--rate-limit", type=float, metavar="N",
+                        help="Send at most N API requests per second")
+    parser.add_argument("--max-retries", type=int, default=3, metavar="N",
+                        help="Retry rate limited, failed idempotent requests up to N times (default 3)")
+    parser.add_argument("--api-endpoint", metavar="URL",
+                        help="Vagrant Cloud API to talk to (or set VAGRANT_CLOUD_API_ENDPOINT)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Print a summary of every API request with its timings to stderr")
+    parser.add_argument("--trace-file", metavar="FILE",
+                        help="Write the request spans to FILE as OpenTelemetry (OTLP) JSON")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help="Profile the command's CPU time (cProfile) or memory allocations (tracemalloc) and "
+                             "print a report to stderr")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="Write the raw pstats file or tracemalloc snapshot to FILE instead of a report")
+    parser.add_argument("--format", choices=FORMATS, default="table",
+                        help="Output format for user and info commands (default table)")
+    subparsers = parser.add_subparsers(title="Commands", dest="command")
+    subparsers.required = True
+
+    # Authenticate
+    parser_validate = subparsers.add_parser("authenticate", help="Get an API token")
+    parser_validate.set_defaults(func="authenticate")
+
+    # Validate
+    parser_validate = subparsers.add_parser("validate", help="Validate API token")
+    parser_validate.set_defaults(func="validate")
+
+    parser_user = subparsers.add_parser("user", help="Get information about a user")
+    parser_user.add_argument("username")
+    parser_user.set_defaults(func="user")
+
+    parser_shell = subparsers.add_parser("shell", help="Read commands interactively and run them all over one API "
+                                                       "session")
+    parser_shell.set_defaults(func="shell")
+
+    parser_batch = subparsers.add_parser("batch", help="Run the commands in a file (one per line, like on the command "
+                                                       "line) over one API session")
+    parser_batch.add_argument("file", nargs="?", default="-", help="File to read the commands from (default stdin)")
+    parser_batch.add_argument("-p", "--parallel", type=int, default=1, metavar="N",
+                              help="Run up to N commands at once. Commands for the same box keep their order, "
+                                   "commands that don't name a box wait for everything before them (default 1)")
+    parser_batch.add_argument("-e", "--stop-on-error", action="store_true",
+                              help="Don't run the commands after a failed one (with --parallel, the ones for the "
+                                   "same box)")
+    parser_batch.set_defaults(func="batch")
+
+    parser_mirror = subparsers.add_parser("mirror", help="Download every released box of some users to a local "
+                                                         "directory that Vagrant or a web server can use as a box "
+                                                         "catalog")
+    parser_mirror.add_argument("orgs", nargs="+", metavar="user",
+                               help="User or organization to mirror, or a box tag like 'myuser/test' or 'myuser/*'")
+    parser_mirror.add_argument("dest", help="Directory to mirror to. Boxes are saved as <user>/<box>/<version>/"
+                                            "<provider>.box next to a <user>/<box>/metadata.json")
+    parser_mirror.add_argument("-j", "--jobs", type=int, default=4,
+                               help="Downloads (and API requests) to run at once (default 4)")
+    parser_mirror.add_argument("-u", "--base-url", metavar="URL",
+                               help="URL the mirror is served from, for the box URLs in metadata.json (default a "
+                                    "file:// URL of the directory)")
+    parser_mirror.add_argument("--unreleased", action="store_true", help="Mirror unreleased versions too")
+    parser_mirror.add_argument("-d", "--delete", action="store_true",
+                               help="Delete boxes, versions and providers that no longer exist upstream")
+    parser_mirror.add_argument("-n", "--dry-run", action="store_true", help="Only show what would be downloaded")
+    parser_mirror.set_defaults(func="mirror")
+
+    for name, help, build in LAZY_COMMANDS:
+        subparser = subparsers.add_parser(name, help=help)
+        if argv is None or name in argv:
+            build(subparser)
+    return parser
+
+
+def run(argv, VC=None):
+    parser = build_parser(argv)
+    args = parser.parse_args(argv)
+    # Commands that aren't VagrantCloudApi methods (the agent's) set a function
+    if callable(args.func):
+        return args.func(args)
+
+    # Imported here so that --help and usage errors don't pay for requests
+    from vagrant_cloud_cli.cache import DiskCache
+    from vagrant_cloud_cli.client import ApiError, VagrantCloudError
+    from vagrant_cloud_cli.vcapi import VagrantCloudApi
+
+    if VC is None:
+        try:
+            VC = VagrantCloudApi(parser)
+        except VagrantCloudError as e:
+            print("Error: %s" % e, file=sys.stderr)
+            return 1
+    else:
+        VC.parser = parser
+        VC.reset()
+    if args.api_endpoint:
+        VC.API_ENDPOINT = args.api_endpoint.rstrip("/")
+    VC.scheduler.set_rate(args.rate_limit)
+    VC.scheduler.max_retries = args.max_retries
+    if args.cache:
+        VC.disk_cache = DiskCache(VC.token, ttl=args.cache_ttl)
+
+    tracer = None
+    if args.trace or args.trace_file:
+        from vagrant_cloud_cli.trace import Tracer
+
+        tracer = Tracer(VC.scheduler)
+        tracer.install(VC)
+    try:
+        result = getattr(VC, args.func)(args)
+    except ApiError as e:
+        for error in e.errors:
+            print("Error: %s" % error)
+        result = 1
+    except VagrantCloudError as e:
+        print("Error: %s" % e)
+        result = 1
+    finally:
+        if tracer:
+            tracer.uninstall()
+            if args.trace:
+                tracer.summary()
+            if args.trace_file:
+                tracer.write_otlp(args.trace_file, " ".join(["vagrant-cloud-cli"] + argv))
+    return result
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    # --profile is looked for before the real parser exists, so that building the parser and
+    # parsing are profiled too
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--profile", choices=PROFILE_MODES)
+    pre_parser.add_argument("--profile-output")
+    options, _ = pre_parser.parse_known_args(argv)
+    if options.profile:
+        from vagrant_cloud_cli.profiling import profiled
+
+        sys.exit(profiled(options.profile, options.profile_output, run, argv))
 
-    args = parser.parse_args()
+    from vagrant_cloud_cli import agent
 
-    args.func(args)
+    if agent.should_forward(argv):
+        result = agent.forward(argv)
+        if result is not None:
+            sys.exit(result)
+    sys.exit(run(argv))
 
 
 if __name__ == "__main__":
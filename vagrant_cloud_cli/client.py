@@ -0,0 +1,545 @@
+import concurrent.futures
+import contextlib
+import email.utils
+import fnmatch
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+from vagrant_cloud_cli.download import DEFAULT_SEGMENT_SIZE, Download, DownloadError
+from vagrant_cloud_cli.errors import VagrantCloudError
+from vagrant_cloud_cli.models import Box, Provider, User, Version
+from vagrant_cloud_cli.upload import DEFAULT_CHUNK_SIZE, Progress, UploadError, UploadJournal, UploadStream
+
+API_ENDPOINT = "https://app.vagrantup.com/api/v1"
+
+
+class TokenMissingError(VagrantCloudError):
+    pass
+
+
+class TransportError(VagrantCloudError):
+    pass
+
+
+class ApiError(VagrantCloudError):
+    def __init__(self, status, errors):
+        super().__init__("HTTP %d: %s" % (status, ", ".join(errors)))
+        self.status = status
+        self.errors = errors
+
+
+class AuthenticationError(ApiError):
+    pass
+
+
+class PermissionDeniedError(ApiError):
+    pass
+
+
+class NotFoundError(ApiError):
+    pass
+
+
+class ValidationError(ApiError):
+    pass
+
+
+class RateLimitError(ApiError):
+    pass
+
+
+ERRORS = {401: AuthenticationError, 403: PermissionDeniedError, 404: NotFoundError, 422: ValidationError,
+          429: RateLimitError}
+
+
+def api_error(status, errors):
+    return ERRORS.get(status, ApiError)(status, errors)
+
+
+def _response_errors(r):
+    try:
+        return r.json()["errors"]
+    except (ValueError, KeyError, TypeError):
+        return ["HTTP %d" % r.status_code]
+
+
+def is_glob(tag):
+    return any(c in tag.partition("/")[2] for c in "*?[")
+
+
+@contextlib.contextmanager
+def _api_errors():
+    # The public methods raise these instead of whatever requests raised
+    try:
+        yield
+    except requests.HTTPError as e:
+        raise api_error(e.response.status_code, _response_errors(e.response)) from None
+    except requests.RequestException as e:
+        raise TransportError(str(e)) from e
+
+
+def error_message(e):
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        try:
+            return ", ".join(e.response.json()["errors"])
+        except (ValueError, KeyError, TypeError):
+            return "HTTP %d" % e.response.status_code
+    if isinstance(e, ApiError):
+        return ", ".join(e.errors)
+    return str(e)
+
+
+class RequestScheduler:
+    # Every request goes through here. A token bucket keeps us under `rate` requests per second
+    # (bursts of up to `burst`), 429s and transient 5xx/connection errors are retried with jittered
+    # exponential backoff, honouring Retry-After. Non-idempotent requests are only retried on 429,
+    # which the API sends before doing anything; bodies that can't be re-sent pass retry=False.
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+    def __init__(self, session, rate=None, burst=None, max_retries=3, backoff=0.5, max_backoff=60.0):
+        self.s = session
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        # attempt is the retry number of the request the current thread is sending
+        self.local = threading.local()
+        self.paused_until = 0.0
+        self.reset_stats()
+        self.set_rate(rate, burst)
+
+    def reset_stats(self):
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "throttled_wait": 0.0, "rate_limited": 0}
+
+    def set_rate(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def _acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # Going negative reserves a slot, the wait is how long until it is paid back
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            if wait:
+                self.stats["throttled"] += 1
+                self.stats["throttled_wait"] += wait
+        if wait:
+            time.sleep(wait)
+
+    def _retry_after(self, r):
+        value = r.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return min(float(value), self.max_backoff)
+        except ValueError:
+            pass
+        try:
+            return min(max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()), self.max_backoff)
+        except (TypeError, ValueError):
+            return None
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, retry=True, **kwargs):
+        attempt = 0
+        while True:
+            self._acquire()
+            self._count("requests")
+            self.local.attempt = attempt
+            try:
+                r = self.s.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not retry or method not in self.IDEMPOTENT or attempt >= self.max_retries:
+                    raise
+                delay = self._delay(attempt)
+            else:
+                if r.status_code not in self.RETRY_STATUSES or not retry or attempt >= self.max_retries:
+                    return r
+                if r.status_code == 429:
+                    self._count("rate_limited")
+                    delay = self._retry_after(r) or self._delay(attempt)
+                    # Everyone else backs off too, not just this request
+                    with self.lock:
+                        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                elif method in self.IDEMPOTENT:
+                    delay = self._retry_after(r) or self._delay(attempt)
+                else:
+                    return r
+            self._count("retries")
+            attempt += 1
+            time.sleep(delay)
+
+
+class VagrantCloudClient:
+    # The API for Python callers: methods take plain arguments, return Box/Version/Provider/User
+    # models and raise ApiError subclasses or TransportError instead of printing anything. The
+    # token defaults to $ATLAS_TOKEN or $VAGRANT_CLOUD_TOKEN, the endpoint to
+    # $VAGRANT_CLOUD_API_ENDPOINT. One session (and its connection pool) serves every call. Every
+    # call fetches fresh documents, unless made inside `with client.memoize():`.
+    def __init__(self, token=None, endpoint=None, rate=None, max_retries=3, hash_index=None):
+        token = token or os.environ.get("ATLAS_TOKEN") or os.environ.get("VAGRANT_CLOUD_TOKEN")
+        if not token:
+            raise TokenMissingError("Neither ATLAS_TOKEN or VAGRANT_CLOUD_TOKEN are defined")
+
+        self.token = token
+        self.endpoint = endpoint
+        self.s = requests.session()
+        self.s.headers.update({
+            "Authorization": "Bearer %s" % token
+        })
+        self.adapter_class = requests.adapters.HTTPAdapter
+        self.scheduler = RequestScheduler(self.s, rate=rate, max_retries=max_retries)
+        # A HashIndex lets uploads compare the file with the provider's checksum without reading it
+        self.hash_index = hash_index
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.s.close()
+        if self.hash_index is not None:
+            self.hash_index.close()
+
+    def reset(self):
+        # Per-command state. A long-lived instance (the agent) calls this between commands so
+        # nothing cached or configured by one leaks into the next; the session and its pool stay.
+        self.API_ENDPOINT = (self.endpoint or os.environ.get("VAGRANT_CLOUD_API_ENDPOINT", API_ENDPOINT)).rstrip("/")
+        # Off by default, a long-lived client must see what other clients change
+        self._responses = None
+        self.disk_cache = None
+        self.show_progress = False
+        self.scheduler.reset_stats()
+
+    def _notice(self, message):
+        pass
+
+    @contextlib.contextmanager
+    def memoize(self):
+        # Inside the block, successful GETs are reused until the next write, so looking up the
+        # same document twice (e.g. _box_exists on an error path) doesn't cost another round-trip
+        if self._responses is not None:
+            yield self
+            return
+        self._responses = {}
+        try:
+            yield self
+        finally:
+            self._responses = None
+
+    def _get(self, page):
+        # A write on another thread replaces the memo, so work with the one this GET started with
+        responses = self._responses
+        r = responses.get(page) if responses is not None else None
+        if r is not None:
+            return r
+        url = self.API_ENDPOINT + page
+        entry = self.disk_cache.get(url) if self.disk_cache else None
+        if entry and self.disk_cache.fresh(entry):
+            r = self.disk_cache.response(entry)
+        else:
+            r = self.scheduler.request("GET", url, headers=self.disk_cache.validators(entry) if entry else None)
+            if r.status_code == 304 and entry:
+                self.disk_cache.refresh(url, entry)
+                r = self.disk_cache.response(entry)
+            else:
+                r.raise_for_status()
+                if self.disk_cache:
+                    self.disk_cache.store(url, r)
+        # If a write came in meanwhile, r may predate it and goes into the memo that was replaced
+        if responses is not None:
+            responses[page] = r
+        return r
+
+    def _invalidate(self, page, data=None):
+        # Replaced rather than cleared, a GET still in flight on another thread mustn't refill it
+        if self._responses is not None:
+            self._responses = {}
+        if not self.disk_cache:
+            return
+        # A write to a box, version or provider changes every document that embeds it
+        parts = page.strip("/").split("/")
+        pages = []
+        if parts[0] == "box" and len(parts) >= 3:
+            pages.append("/user/" + parts[1])
+            for i in range(3, min(len(parts), 7) + 1, 2):
+                pages.append("/" + "/".join(parts[:i]))
+        elif parts[0] == "boxes" and data:
+            pages.append("/user/" + data["box"]["username"])
+        for invalid in pages:
+            self.disk_cache.invalidate(self.API_ENDPOINT + invalid)
+
+    def _post(self, page, data):
+        self._invalidate(page, data)
+        r = self.scheduler.request("POST", self.API_ENDPOINT + page, json=data)
+        r.raise_for_status()
+        return r
+
+    def _put(self, page, data={}):
+        self._invalidate(page)
+        r = self.scheduler.request("PUT", self.API_ENDPOINT + page, json=data)
+        r.raise_for_status()
+        return r
+
+    def _delete(self, page):
+        self._invalidate(page)
+        r = self.scheduler.request("DELETE", self.API_ENDPOINT + page)
+        r.raise_for_status()
+        return r
+
+    def _mount(self, pool_maxsize=requests.adapters.DEFAULT_POOLSIZE):
+        adapter = self.adapter_class(pool_maxsize=pool_maxsize)
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
+
+    def _set_concurrency(self, jobs):
+        self._mount(max(jobs, requests.adapters.DEFAULT_POOLSIZE))
+        # Interleaved progress lines from several uploads are unreadable
+        self.show_progress = jobs == 1
+
+    def _upload(self, upload_path, file, chunk_size=DEFAULT_CHUNK_SIZE, checksum_type="sha256", headers=None,
+                use_mmap=True):
+        progress = Progress() if self.show_progress and sys.stderr.isatty() else None
+        with UploadStream(file, chunk_size, progress, checksum_type, use_mmap) as stream:
+            # The stream can only be read once
+            r = self.scheduler.request("PUT", upload_path, retry=False, data=stream, headers=headers)
+        r.raise_for_status()
+        return stream
+
+    def _uploaded(self, provider_path, file):
+        # Whether the provider already hosts this file: its checksum, from the index unless the
+        # file has changed since it was last hashed, is the one set on the provider
+        data = self._get(provider_path).json()
+        if not data.get("hosted") or not data.get("checksum"):
+            return False
+        return self.hash_index.checksum(file, data.get("checksum_type") or "sha256") == data["checksum"].lower()
+
+    def _upload_provider(self, tag, version, provider, file, chunk_size=DEFAULT_CHUNK_SIZE, checksum_type="sha256",
+                         direct=False, use_mmap=True, force=False):
+        # Returns the finished UploadStream, or None if the journal or the file's checksum shows
+        # this file is already uploaded
+        if not os.path.isfile(file) or not os.access(file, os.R_OK):
+            raise UploadError("File '%s' doesn't exist or isn't readable" % file)
+        provider_path = "/box/" + tag + "/version/" + version + "/provider/" + provider
+        journal = UploadJournal(file, tag, version, provider)
+        if not force:
+            if journal.complete():
+                r = self._get(provider_path)
+                if r.json().get("hosted"):
+                    return None
+            elif journal.load():
+                self._notice("Previous upload of '%s' was interrupted, uploading it again" % file)
+            if self.hash_index is not None and self._uploaded(provider_path, file):
+                journal.save(os.path.getsize(file))
+                return None
+
+        st = os.stat(file)
+        journal.save(0)
+        if direct:
+            r = self._get(provider_path + "/upload/direct")
+            data = r.json()
+            try:
+                # upload_path is a pre-signed object storage URL, it must not be sent our API token
+                stream = self._upload(data["upload_path"], file, chunk_size, checksum_type,
+                                      headers={"Authorization": None}, use_mmap=use_mmap)
+            except requests.HTTPError as e:
+                raise UploadError("Upload to storage failed with HTTP %d" % e.response.status_code)
+            r = self.scheduler.request("PUT", data["callback"])
+            r.raise_for_status()
+        else:
+            r = self._get(provider_path + "/upload")
+            data = r.json()
+            stream = self._upload(data["upload_path"], file, chunk_size, checksum_type, use_mmap=use_mmap)
+        journal.save(stream.sent, checksum_type, stream.checksum)
+        if self.hash_index is not None and checksum_type:
+            self.hash_index.put(file, checksum_type, stream.checksum, st)
+        self._invalidate(provider_path)
+
+        if checksum_type:
+            r = self._put(provider_path, {"provider": {"checksum": stream.checksum,
+                                                       "checksum_type": checksum_type}})
+        if direct:
+            if not checksum_type:
+                r = self._get(provider_path)
+            if not r.json().get("hosted"):
+                raise UploadError("Provider '%s' is not hosted after the upload" % provider)
+        return stream
+
+    def validate_token(self):
+        try:
+            with _api_errors():
+                self._get("/authenticate")
+        except AuthenticationError:
+            return False
+        return True
+
+    def get_user(self, username):
+        with _api_errors():
+            return User.from_json(self._get("/user/" + username).json())
+
+    def get_box(self, tag):
+        with _api_errors():
+            return Box.from_json(self._get("/box/" + tag).json())
+
+    def expand_tags(self, patterns):
+        # Tags like "myuser/*" (any glob on the box name) become the matching boxes from one
+        # /user/<name> listing per user, plain tags are kept as they are
+        tags = []
+        for pattern in patterns:
+            if not is_glob(pattern):
+                tags.append(pattern)
+                continue
+            username, _, name = pattern.partition("/")
+            user = self.get_user(username)
+            tags += [box.tag for box in user.boxes if fnmatch.fnmatchcase(box.name, name)]
+        return list(dict.fromkeys(tags))
+
+    def get_boxes(self, tags, jobs=4):
+        # Fetched concurrently, boxes that don't exist map to None
+        def fetch(tag):
+            try:
+                return self.get_box(tag)
+            except NotFoundError:
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            return dict(zip(tags, pool.map(fetch, tags)))
+
+    def box_exists(self, tag):
+        try:
+            self.get_box(tag)
+        except NotFoundError:
+            return False
+        return True
+
+    def create_box(self, username, name, short_description=None, private=False):
+        data = {"box": {"username": username, "name": name, "short_description": short_description,
+                        "is_private": private}}
+        with _api_errors():
+            return Box.from_json(self._post("/boxes", data).json())
+
+    def update_box(self, tag, name=None, short_description=None, private=None):
+        data = {"box": {}}
+        if name is not None:
+            data["box"]["name"] = name
+        if short_description is not None:
+            data["box"]["short_description"] = short_description
+        if private is not None:
+            data["box"]["is_private"] = private
+        with _api_errors():
+            return Box.from_json(self._put("/box/" + tag, data).json())
+
+    def delete_box(self, tag):
+        with _api_errors():
+            return Box.from_json(self._delete("/box/" + tag).json())
+
+    def get_version(self, tag, version):
+        with _api_errors():
+            return Version.from_json(self._get("/box/%s/version/%s" % (tag, version)).json())
+
+    def create_version(self, tag, version, description=None):
+        data = {"version": {"version": version, "description": description}}
+        with _api_errors():
+            return Version.from_json(self._post("/box/%s/versions" % tag, data).json())
+
+    def update_version(self, tag, version, new_version=None, description=None):
+        data = {"version": {}}
+        if new_version is not None:
+            data["version"]["version"] = new_version
+        if description is not None:
+            data["version"]["description"] = description
+        with _api_errors():
+            return Version.from_json(self._put("/box/%s/version/%s" % (tag, version), data).json())
+
+    def delete_version(self, tag, version):
+        with _api_errors():
+            return Version.from_json(self._delete("/box/%s/version/%s" % (tag, version)).json())
+
+    def release_version(self, tag, version):
+        with _api_errors():
+            return Version.from_json(self._put("/box/%s/version/%s/release" % (tag, version)).json())
+
+    def revoke_version(self, tag, version):
+        with _api_errors():
+            return Version.from_json(self._put("/box/%s/version/%s/revoke" % (tag, version)).json())
+
+    def get_provider(self, tag, version, provider):
+        with _api_errors():
+            return Provider.from_json(self._get("/box/%s/version/%s/provider/%s" % (tag, version, provider)).json())
+
+    def create_provider(self, tag, version, provider, url=None, checksum=None, checksum_type="sha256"):
+        data = {"provider": {"name": provider, "url": url}}
+        if checksum:
+            data["provider"].update({"checksum": checksum, "checksum_type": checksum_type})
+        with _api_errors():
+            return Provider.from_json(self._post("/box/%s/version/%s/providers" % (tag, version), data).json())
+
+    def update_provider(self, tag, version, provider, new_provider=None, url=None, checksum=None,
+                        checksum_type="sha256"):
+        data = {"provider": {}}
+        if new_provider is not None:
+            data["provider"]["name"] = new_provider
+        if url is not None:
+            data["provider"]["url"] = url
+        if checksum:
+            data["provider"].update({"checksum": checksum, "checksum_type": checksum_type})
+        with _api_errors():
+            return Provider.from_json(self._put("/box/%s/version/%s/provider/%s" % (tag, version, provider),
+                                                data).json())
+
+    def delete_provider(self, tag, version, provider):
+        with _api_errors():
+            return Provider.from_json(self._delete("/box/%s/version/%s/provider/%s" % (tag, version, provider))
+                                      .json())
+
+    def download_provider(self, tag, version, provider, path, jobs=4, segment_size=DEFAULT_SEGMENT_SIZE, verify=True):
+        # Returns the finished Download (size, received, resumed, elapsed, rate, checksum). The
+        # checksum set on the provider is verified unless verify is false; without one, sha256
+        # is computed for reference.
+        info = self.get_provider(tag, version, provider)
+        # One connection per segment being fetched
+        self._mount(max(jobs, requests.adapters.DEFAULT_POOLSIZE))
+        return self._download_provider(tag, version, info, path, jobs, segment_size, verify)
+
+    def _download_provider(self, tag, version, provider, path, jobs=4, segment_size=DEFAULT_SEGMENT_SIZE,
+                           verify=True):
+        # provider is the Provider model, e.g. from a box listing that has already been fetched
+        if not provider.download_url:
+            raise DownloadError("Provider '%s' has no download URL" % provider.name)
+        progress = Progress() if self.show_progress and sys.stderr.isatty() else None
+        download = Download(self.s, provider.download_url, path, jobs, segment_size,
+                            provider.checksum if verify else None, provider.checksum_type or "sha256",
+                            "%s/%s/%s" % (tag, version, provider.name), progress, self.scheduler.max_retries)
+        with _api_errors():
+            return download.run()
+
+    def upload_provider(self, tag, version, provider, file, chunk_size=DEFAULT_CHUNK_SIZE, checksum_type="sha256",
+                        direct=False, use_mmap=True, force=False):
+        # Returns the finished UploadStream (sent, elapsed, rate, checksum), or None if the upload
+        # journal or (with a hash_index) the provider's checksum shows this file was already uploaded
+        with _api_errors(), self.memoize():
+            return self._upload_provider(tag, version, provider, file, chunk_size, checksum_type, direct, use_mmap,
+                                         force)
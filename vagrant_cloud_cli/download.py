@@ -0,0 +1,257 @@
+import concurrent.futures
+import errno
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from vagrant_cloud_cli.errors import VagrantCloudError
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+class DownloadError(VagrantCloudError):
+    pass
+
+
+class DownloadState:
+    # Kept next to the partial file: what is being downloaded, then the index of every segment
+    # that is on disk, one per line. Appending a line is cheap enough to do after each segment.
+    SUFFIX = ".state"
+
+    def __init__(self, part, identity):
+        self.path = part + self.SUFFIX
+        self.identity = identity
+        self.lock = threading.Lock()
+        self.f = None
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+            if json.loads(lines[0]) != self.identity:
+                return set()
+            # A line cut short by a crash is just that segment downloaded again
+            return {int(line) for line in lines[1:] if line.isdigit()}
+        except (OSError, ValueError, IndexError):
+            return set()
+
+    def open(self, done):
+        self.f = open(self.path, "w")
+        self.f.write(json.dumps(self.identity) + "\n")
+        self.f.write("".join("%d\n" % index for index in sorted(done)))
+        self.f.flush()
+
+    def add(self, index):
+        with self.lock:
+            self.f.write("%d\n" % index)
+            self.f.flush()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Download:
+    # Fetches url into path with up to `jobs` concurrent Range requests over the session's
+    # connection pool. Each segment is written straight into its place in a preallocated
+    # <path>.part with pwrite, finished ones are recorded in a DownloadState so an interrupted
+    # download resumes. The checksum is computed over the completed prefix of the file as
+    # segments finish (mostly from the page cache), so only the tail is left to hash at the end.
+    # Servers that ignore Range get a single streamed GET.
+    def __init__(self, session, url, path, jobs=4, segment_size=DEFAULT_SEGMENT_SIZE, checksum=None,
+                 checksum_type="sha256", identity=None, progress=None, max_retries=3):
+        self.s = session
+        self.url = url
+        self.path = path
+        self.part = path + ".part"
+        self.jobs = jobs
+        self.segment_size = segment_size
+        self.expected = checksum.lower() if checksum else None
+        self.checksum_type = checksum_type
+        self.hash = hashlib.new(checksum_type)
+        self.identity = identity
+        self.progress = progress
+        self.max_retries = max_retries
+        self.headers = {}
+        self.lock = threading.Lock()
+        self.size = None
+        self.received = 0
+        self.resumed = 0
+        self.connections = 1
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        return self.received / max(self.elapsed, 1e-6)
+
+    @property
+    def checksum(self):
+        return self.hash.hexdigest()
+
+    def _count(self, size):
+        with self.lock:
+            self.received += size
+            if self.progress:
+                self.progress(self.resumed + self.received, self.size)
+
+    def _probe(self):
+        r = self.s.get(self.url, headers={"Range": "bytes=0-0"}, stream=True)
+        if r.status_code == 416:
+            # Nothing to download, not even the first byte
+            r.close()
+            self.size = 0
+            return None
+        r.raise_for_status()
+        # Storage behind a redirect gets the final URL, without the API token that requests
+        # already dropped on the way there
+        if urlsplit(r.url).netloc != urlsplit(self.url).netloc:
+            self.headers["Authorization"] = None
+        self.url = r.url
+        match = re.fullmatch(r"bytes 0-0/(\d+)", r.headers.get("Content-Range", ""))
+        if r.status_code == 206 and match:
+            r.close()
+            self.size = int(match.group(1))
+            return None
+        self.size = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+        return r
+
+    def _stream(self, r):
+        with r, open(self.part, "wb") as f:
+            for chunk in r.iter_content(READ_SIZE):
+                f.write(chunk)
+                self.hash.update(chunk)
+                self._count(len(chunk))
+        if self.size is not None and self.received != self.size:
+            raise DownloadError("Download ended after %d of %d bytes" % (self.received, self.size))
+
+    def _fetch(self, fd, index):
+        offset = index * self.segment_size
+        end = min(offset + self.segment_size, self.size)
+        buffer = bytearray(READ_SIZE)
+        view = memoryview(buffer)
+        attempt = 0
+        while True:
+            try:
+                headers = dict(self.headers, Range="bytes=%d-%d" % (offset, end - 1))
+                with self.s.get(self.url, headers=headers, stream=True) as r:
+                    if r.status_code >= 500:
+                        r.raise_for_status()
+                    if r.status_code != 206:
+                        raise DownloadError("Server answered a Range request with HTTP %d" % r.status_code)
+                    while offset < end:
+                        n = r.raw.readinto(view[:min(READ_SIZE, end - offset)])
+                        if not n:
+                            break
+                        os.pwrite(fd, view[:n], offset)
+                        offset += n
+                        self._count(n)
+                if offset == end:
+                    return index
+                raise requests.ConnectionError("Connection closed %d bytes short" % (end - offset))
+            except requests.RequestException:
+                # What was received stays, the retry asks for the rest of the segment
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+                attempt += 1
+
+    def _hash_segment(self, fd, index):
+        offset = index * self.segment_size
+        end = min(offset + self.segment_size, self.size)
+        while offset < end:
+            data = os.pread(fd, min(READ_SIZE, end - offset), offset)
+            if not data:
+                raise DownloadError("'%s' is shorter than expected" % self.part)
+            self.hash.update(data)
+            offset += len(data)
+
+    def _ranged(self):
+        segments = (self.size + self.segment_size - 1) // self.segment_size
+        identity = {"source": self.identity or self.url, "size": self.size, "segment_size": self.segment_size,
+                    "checksum": self.expected}
+        state = DownloadState(self.part, identity)
+        done = set()
+        if os.path.exists(self.part) and os.path.getsize(self.part) == self.size:
+            done = {index for index in state.load() if index < segments}
+        self.resumed = sum(min(self.segment_size, self.size - index * self.segment_size) for index in done)
+
+        fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not done:
+                os.ftruncate(fd, self.size)
+                # Reserving the blocks up front keeps the file contiguous and fails now, not
+                # halfway through, when the disk is too small
+                if hasattr(os, "posix_fallocate") and self.size:
+                    try:
+                        os.posix_fallocate(fd, 0, self.size)
+                    except OSError as e:
+                        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                            raise
+            state.open(done)
+            hashed = 0
+            pending = [index for index in range(segments) if index not in done]
+            self.connections = min(self.jobs, len(pending)) or 1
+            with concurrent.futures.ThreadPoolExecutor(self.jobs) as pool:
+                futures = [pool.submit(self._fetch, fd, index) for index in pending]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        index = future.result()
+                        state.add(index)
+                        done.add(index)
+                        while hashed in done:
+                            self._hash_segment(fd, hashed)
+                            hashed += 1
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            while hashed < segments:
+                self._hash_segment(fd, hashed)
+                hashed += 1
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            state.close()
+        return state
+
+    def run(self):
+        self.started = time.monotonic()
+        r = self._probe()
+        if r is not None:
+            self._stream(r)
+            state = None
+        else:
+            state = self._ranged()
+        self.finished = time.monotonic()
+
+        if self.expected and self.checksum != self.expected:
+            os.unlink(self.part)
+            if state:
+                state.remove()
+            raise DownloadError("Checksum mismatch: expected %s %s, got %s" % (self.checksum_type, self.expected,
+                                                                              self.checksum))
+        os.replace(self.part, self.path)
+        if state:
+            state.remove()
+        return self
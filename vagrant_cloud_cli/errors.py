@@ -0,0 +1,3 @@
+class VagrantCloudError(Exception):
+    # Base of every error the library raises, here so that upload and download can use it too
+    pass
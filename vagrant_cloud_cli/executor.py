@@ -0,0 +1,71 @@
+import concurrent.futures
+
+
+class Task:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.state = "pending"
+        self.result = None
+        self.error = None
+
+
+class Executor:
+    # Runs tasks on a bounded thread pool. A task is started once all of its dependencies have
+    # finished successfully; if any of them failed or was skipped, the task is skipped too.
+    def __init__(self, jobs=4, report=None):
+        self.jobs = jobs
+        self.report = report
+        self.tasks = []
+
+    def add(self, name, func, deps=()):
+        task = Task(name, func, [dep for dep in deps if dep is not None])
+        self.tasks.append(task)
+        return task
+
+    def _report(self, task):
+        if self.report:
+            self.report(task)
+
+    def run(self):
+        pending = list(self.tasks)
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as pool:
+            while pending or running:
+                changed = True
+                while changed:
+                    changed = False
+                    for task in list(pending):
+                        if any(dep.state in ("failed", "skipped") for dep in task.deps):
+                            task.state = "skipped"
+                        elif all(dep.state == "done" for dep in task.deps):
+                            task.state = "running"
+                            running[pool.submit(task.func)] = task
+                        else:
+                            continue
+                        pending.remove(task)
+                        changed = True
+                        if task.state == "skipped":
+                            self._report(task)
+
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        task.result = future.result()
+                        task.state = "done"
+                    except Exception as e:
+                        task.error = e
+                        task.state = "failed"
+                    self._report(task)
+        return self.summary()
+
+    def summary(self):
+        counts = {}
+        for task in self.tasks:
+            counts[task.state] = counts.get(task.state, 0) + 1
+        return counts
+
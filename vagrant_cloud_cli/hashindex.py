@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+
+from vagrant_cloud_cli.upload import DEFAULT_CHUNK_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT NOT NULL,
+    checksum_type TEXT NOT NULL,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (path, checksum_type)
+)
+"""
+
+
+def default_index_path():
+    return os.environ.get("VAGRANT_CLOUD_CLI_HASH_INDEX") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "vagrant-cloud-cli", "hashes.sqlite")
+
+
+def _identity(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashIndex:
+    # Remembers the checksum of each file by (path, device, inode, size, mtime), so a multi-GB
+    # box that hasn't been touched since it was last hashed or uploaded isn't read again. A file
+    # that is rewritten or replaced gets a new mtime or inode and is hashed again. The database
+    # is only opened on first use.
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        self.lock = threading.Lock()
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            import sqlite3
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Shared by the upload threads of apply, every use holds the lock
+            self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.db.execute(SCHEMA)
+        return self.db
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def get(self, file, checksum_type, st=None):
+        st = st or os.stat(file)
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT device, inode, size, mtime_ns, checksum FROM hashes WHERE path = ? AND checksum_type = ?",
+                (os.path.abspath(file), checksum_type)).fetchone()
+        if row is None or tuple(row[:4]) != _identity(st):
+            return None
+        return row[4]
+
+    def put(self, file, checksum_type, checksum, st=None):
+        # st is the stat taken before the file was read, if it has changed since the entry won't match
+        st = st or os.stat(file)
+        with self.lock, self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (os.path.abspath(file), checksum_type) + _identity(st) + (checksum,))
+
+    def checksum(self, file, checksum_type="sha256"):
+        st = os.stat(file)
+        checksum = self.get(file, checksum_type, st)
+        if checksum is None:
+            h = hashlib.new(checksum_type)
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                    h.update(block)
+            checksum = h.hexdigest()
+            self.put(file, checksum_type, checksum, st)
+        return checksum
+
+    def clear(self):
+        with self.lock, self._connect() as db:
+            return db.execute("DELETE FROM hashes").rowcount
+
+    def stats(self):
+        with self.lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        return {"path": self.path, "entries": entries}
@@ -0,0 +1,185 @@
+import concurrent.futures
+import json
+import os
+
+import requests
+
+from vagrant_cloud_cli.upload import CHECKSUM_TYPES, format_size
+
+
+class ManifestError(Exception):
+    pass
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            text = f.read()
+    except OSError as e:
+        raise ManifestError("Unable to read manifest '%s': %s" % (path, e.strerror))
+
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ManifestError("PyYAML is required to read YAML manifests, install it or use a JSON manifest")
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ManifestError("Invalid YAML in '%s': %s" % (path, e))
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ManifestError("Invalid JSON in '%s': %s" % (path, e))
+
+    if not isinstance(data, dict) or not isinstance(data.get("boxes"), list):
+        raise ManifestError("Manifest must contain a list of 'boxes'")
+    base = os.path.dirname(os.path.abspath(path))
+    for box in data["boxes"]:
+        check_box(box, base)
+    return data["boxes"]
+
+
+def check_box(box, base):
+    tag = box.get("tag")
+    if not isinstance(tag, str) or tag.count("/") != 1:
+        raise ManifestError("Box tag %r must be in the format 'myuser/test'" % (tag,))
+    box.setdefault("versions", [])
+    for version in box["versions"]:
+        if "version" not in version:
+            raise ManifestError("Version of box '%s' has no 'version'" % tag)
+        # YAML reads 1.0 as a float
+        version["version"] = str(version["version"])
+        version.setdefault("providers", [])
+        for provider in version["providers"]:
+            if "name" not in provider:
+                raise ManifestError("Provider of '%s' v%s has no 'name'" % (tag, version["version"]))
+            if ("file" in provider) == ("url" in provider):
+                raise ManifestError("Provider '%s' of '%s' v%s needs exactly one of 'file' or 'url'" %
+                                    (provider["name"], tag, version["version"]))
+            if provider.get("checksum_type", "sha256") not in CHECKSUM_TYPES:
+                raise ManifestError("Provider '%s' of '%s' v%s has an unknown checksum_type '%s'" %
+                                    (provider["name"], tag, version["version"], provider["checksum_type"]))
+            if "file" in provider:
+                provider["file"] = os.path.join(base, provider["file"])
+                # Checked before anything is created remotely, or a version would be left half published
+                if not os.path.isfile(provider["file"]) or not os.access(provider["file"], os.R_OK):
+                    raise ManifestError("File '%s' of provider '%s' of '%s' v%s doesn't exist or isn't readable" %
+                                        (provider["file"], provider["name"], tag, version["version"]))
+
+
+def fetch_remote(api, boxes, jobs):
+    # One GET per box, its document already embeds every version and provider
+    def fetch(tag):
+        try:
+            return api._get("/box/" + tag).json()
+        except requests.HTTPError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+
+    tags = [box["tag"] for box in boxes]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        return dict(zip(tags, pool.map(fetch, tags)))
+
+
+def _request(method, page, data=None):
+    def run():
+        if data is None:
+            method(page)
+        else:
+            method(page, data)
+    return run
+
+
+def plan(api, boxes, remote, executor, upload_options, force_upload=False):
+    for box in boxes:
+        tag = box["tag"]
+        current = remote.get(tag)
+        box_task = None
+        if current is None:
+            username, name = tag.split("/")
+            data = {"box": {"username": username, "name": name, "short_description": box.get("description"),
+                            "is_private": box.get("private", False)}}
+            box_task = executor.add("create box %s" % tag, _request(api._post, "/boxes", data))
+        else:
+            data = {"box": {}}
+            if "description" in box and box["description"] != current.get("short_description"):
+                data["box"]["short_description"] = box["description"]
+            if "private" in box and box["private"] != current.get("private"):
+                data["box"]["is_private"] = box["private"]
+            if data["box"]:
+                executor.add("update box %s" % tag, _request(api._put, "/box/" + tag, data))
+
+        remote_versions = {v["version"]: v for v in current["versions"]} if current else {}
+        for version in box["versions"]:
+            _plan_version(api, tag, version, remote_versions.get(version["version"]), box_task, executor,
+                          upload_options, force_upload)
+
+
+def _plan_version(api, tag, version, current, box_task, executor, upload_options, force_upload):
+    version_path = "/box/" + tag + "/version/" + version["version"]
+    label = "%s v%s" % (tag, version["version"])
+    version_task = None
+    if current is None:
+        data = {"version": {"version": version["version"], "description": version.get("description")}}
+        version_task = executor.add("create version %s" % label,
+                                    _request(api._post, "/box/" + tag + "/versions", data), [box_task])
+    elif "description" in version and version["description"] != current.get("description_markdown"):
+        data = {"version": {"description": version["description"]}}
+        executor.add("update version %s" % label, _request(api._put, version_path, data))
+
+    remote_providers = {p["name"]: p for p in current["providers"]} if current else {}
+    provider_tasks = []
+    for provider in version["providers"]:
+        existing = remote_providers.get(provider["name"])
+        data = {"name": provider["name"]}
+        if "url" in provider:
+            data["url"] = provider["url"]
+        if "checksum" in provider:
+            data.update({"checksum": provider["checksum"], "checksum_type": provider.get("checksum_type", "sha256")})
+
+        provider_task = None
+        provider_label = "%s %s" % (label, provider["name"])
+        if existing is None:
+            provider_task = executor.add("create provider %s" % provider_label,
+                                         _request(api._post, version_path + "/providers", {"provider": data}),
+                                         [version_task])
+        else:
+            changed = {k: v for k, v in data.items()
+                       if k != "name" and v != existing.get("original_url" if k == "url" else k)}
+            if changed:
+                provider_task = executor.add("update provider %s" % provider_label,
+                                             _request(api._put, version_path + "/provider/" + provider["name"],
+                                                      {"provider": changed}))
+        if provider_task:
+            provider_tasks.append(provider_task)
+
+        if "file" in provider:
+            # Whether the file has changed is only known locally: the upload is skipped when the
+            # journal or the file's checksum shows the provider already has it. A new checksum in
+            # the manifest has been set on the provider by then, so it can't be compared with.
+            force = force_upload or (existing is not None and "checksum" in provider and
+                                     provider["checksum"] != existing.get("checksum"))
+            provider_tasks.append(executor.add("upload %s" % provider_label,
+                                               _upload(api, tag, version["version"], provider, upload_options,
+                                                       force),
+                                               [provider_task]))
+
+    if version.get("release") and (current is None or current.get("status") != "active"):
+        executor.add("release %s" % label, _request(api._put, version_path + "/release"),
+                     [version_task] + provider_tasks)
+
+
+def _upload(api, tag, version, provider, upload_options, force):
+    def run():
+        options = dict(upload_options, checksum_type=provider.get("checksum_type", "sha256"))
+        stream = api._upload_provider(tag, version, provider["name"], provider["file"], force=force, **options)
+        if stream is None:
+            return "already uploaded"
+        if "checksum" in provider and stream.checksum != provider["checksum"]:
+            raise ValueError("%s checksum of '%s' is %s, the manifest says %s" %
+                             (stream.checksum_type, provider["file"], stream.checksum, provider["checksum"]))
+        return "%s in %.1fs (%s/s)" % (format_size(stream.sent), stream.elapsed, format_size(stream.rate))
+    return run
@@ -0,0 +1,175 @@
+import json
+import os
+import pathlib
+import shutil
+import sys
+from urllib.parse import quote
+
+from vagrant_cloud_cli.executor import Executor
+from vagrant_cloud_cli.upload import format_size
+from vagrant_cloud_cli.vcapi import error_message
+
+# <dest>/<user>/<box>/ holds metadata.json, <version>/<provider>.box and the state of the mirror:
+# what each .box was downloaded as, to tell on the next run whether it has changed
+METADATA = "metadata.json"
+STATE = ".mirror-state.json"
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    # Written next to the old file and renamed over it, a box server never serves half a file
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
+
+
+def _unchanged(entry, provider, path):
+    if not entry or not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+        return False
+    if provider.checksum:
+        return (provider.checksum.lower() == entry["checksum"] and
+                (provider.checksum_type or "sha256") == entry["checksum_type"])
+    # Without a checksum to compare, a provider that hasn't been updated hasn't changed
+    return provider.updated_at == entry["updated_at"]
+
+
+def _metadata(box, versions, state, base_url):
+    # The format `vagrant box add <url>/metadata.json` reads
+    metadata = {"name": box.tag, "description": box.short_description or "", "versions": []}
+    for version in versions:
+        providers = []
+        for provider in version.providers:
+            entry = state.get("%s/%s" % (version.version, provider.name))
+            if entry:
+                providers.append({"name": provider.name, "checksum_type": entry["checksum_type"],
+                                  "checksum": entry["checksum"],
+                                  "url": "%s/%s/%s/%s.box" % (base_url, quote(box.tag), quote(version.version),
+                                                              quote(provider.name))})
+        if providers:
+            metadata["versions"].append({"version": version.version, "providers": providers})
+    return metadata
+
+
+def _remove_stale(directory, published):
+    # Every <version>/<provider>.box on disk, not only the ones in the state, so that what an
+    # earlier run without --delete left behind goes too
+    for version in sorted(os.listdir(directory)):
+        if not os.path.isdir(os.path.join(directory, version)):
+            continue
+        for name in sorted(os.listdir(os.path.join(directory, version))):
+            if name.endswith(".box") and "%s/%s" % (version, name[:-4]) not in published:
+                os.unlink(os.path.join(directory, version, name))
+                print("Removed '%s', the provider no longer exists" % os.path.join(directory, version, name))
+        if not os.listdir(os.path.join(directory, version)):
+            os.rmdir(os.path.join(directory, version))
+
+
+def mirror(api, args):
+    patterns = [org if "/" in org else org + "/*" for org in args.orgs]
+    tags = api.expand_tags(patterns)
+    if not tags:
+        print("No boxes match %s" % ", ".join(args.orgs))
+        return 1
+    base_url = (args.base_url or pathlib.Path(args.dest).resolve().as_uri()).rstrip("/")
+
+    # One GET per box for all of its versions and providers, then only the downloads
+    api._set_concurrency(args.jobs)
+    boxes = api.get_boxes(tags, args.jobs)
+    executor = Executor(args.jobs, _report)
+    plans = []
+    missing = unchanged = 0
+    for tag in tags:
+        box = boxes[tag]
+        if box is None:
+            print("Box '%s' does not exist" % tag)
+            missing += 1
+            continue
+        directory = os.path.join(args.dest, *tag.split("/"))
+        state = _load_state(os.path.join(directory, STATE))
+        versions = [version for version in box.versions if args.unreleased or version.status == "active"]
+        tasks = {}
+        for version in versions:
+            for provider in version.providers:
+                key = "%s/%s" % (version.version, provider.name)
+                path = os.path.join(directory, version.version, provider.name + ".box")
+                if _unchanged(state.get(key), provider, path):
+                    unchanged += 1
+                    continue
+                task = executor.add("%s v%s %s" % (tag, version.version, provider.name),
+                                    _download(api, tag, version.version, provider, path))
+                tasks[key] = (task, provider, path)
+        plans.append((box, directory, versions, state, tasks))
+
+    if args.dry_run:
+        for box, directory, versions, state, tasks in plans:
+            for task, provider, path in tasks.values():
+                print("Would download %s to '%s'" % (task.name, path))
+        print("%d boxes: %d providers to download, %d unchanged" % (len(plans), len(executor.tasks), unchanged))
+        return 1 if missing else None
+
+    executor.run()
+    downloaded = received = 0
+    failed = missing
+    for box, directory, versions, state, tasks in plans:
+        for key, (task, provider, path) in tasks.items():
+            if task.state != "done":
+                failed += 1
+                continue
+            downloaded += 1
+            received += task.result.received
+            state[key] = {"checksum": task.result.checksum, "checksum_type": task.result.checksum_type,
+                          "updated_at": provider.updated_at, "size": os.path.getsize(path)}
+        # Versions and providers that are gone upstream are dropped from the mirror
+        published = {"%s/%s" % (version.version, provider.name) for version in versions
+                     for provider in version.providers}
+        for key in set(state) - published:
+            del state[key]
+        os.makedirs(directory, exist_ok=True)
+        if args.delete:
+            _remove_stale(directory, published)
+        _write_json(os.path.join(directory, STATE), state)
+        _write_json(os.path.join(directory, METADATA), _metadata(box, versions, state, base_url))
+
+    # Boxes that are gone from a mirrored user
+    for org in args.orgs:
+        if "/" in org or not os.path.isdir(os.path.join(args.dest, org)):
+            continue
+        for name in sorted(os.listdir(os.path.join(args.dest, org))):
+            directory = os.path.join(args.dest, org, name)
+            if "%s/%s" % (org, name) in tags or not os.path.exists(os.path.join(directory, STATE)):
+                continue
+            if args.delete:
+                shutil.rmtree(directory)
+                print("Removed '%s', the box no longer exists" % directory)
+            else:
+                print("'%s' no longer exists upstream (use --delete to remove it)" % directory)
+
+    print("%d boxes: %d providers downloaded (%s), %d unchanged, %d failed" %
+          (len(plans), downloaded, format_size(received), unchanged, failed))
+    if failed:
+        return 1
+
+
+def _download(api, tag, version, provider, path):
+    def run():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # -j limits the connections of the whole mirror, so each download gets one
+        return api._download_provider(tag, version, provider, path, 1)
+    return run
+
+
+def _report(task):
+    if task.state == "done":
+        download = task.result
+        print("Downloaded %s (%s in %.1fs, %s/s)" % (task.name, format_size(download.received), download.elapsed,
+                                                      format_size(download.rate)))
+    else:
+        print("Error: %s: %s" % (task.name, error_message(task.error)), file=sys.stderr)
@@ -0,0 +1,84 @@
+import datetime
+
+
+def parse_time(date_string):
+    # The API always sends ISO-8601 timestamps like 2017-10-20T19:55:40.543Z, which fromisoformat
+    # reads much faster than dateutil once the Z is spelled as an offset
+    try:
+        dt = datetime.datetime.fromisoformat(date_string.replace("Z", "+00:00"))
+    except ValueError:
+        import dateutil.parser
+
+        dt = dateutil.parser.parse(date_string)
+    # One without an offset is taken to be in UTC, so that all of them compare
+    return dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+
+
+class Model:
+    # A compact view of an API document: only the fields named in __slots__ are kept, under the
+    # API's own names. Timestamps stay ISO-8601 strings, see parse_time. Nested documents become
+    # models too.
+    __slots__ = ()
+    _nested = {}
+    _lists = {}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_json(cls, data):
+        fields = {name: data.get(name) for name in cls.__slots__}
+        for name, model in cls._nested.items():
+            if fields[name] is not None:
+                fields[name] = model.from_json(fields[name])
+        for name, model in cls._lists.items():
+            fields[name] = [model.from_json(item) for item in fields[name] or []]
+        return cls(**fields)
+
+    def to_dict(self):
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, Model):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() for item in value]
+            data[name] = value
+        return data
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name)
+                                                 for name in self.__slots__)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % (name, getattr(self, name))
+                                                          for name in self.__slots__[:2]))
+
+
+class Provider(Model):
+    __slots__ = ("name", "hosted", "original_url", "download_url", "checksum", "checksum_type", "created_at",
+                 "updated_at")
+
+
+class Version(Model):
+    __slots__ = ("version", "status", "description_markdown", "downloads", "created_at", "updated_at", "providers")
+    _lists = {"providers": Provider}
+
+    def provider(self, name):
+        return next((provider for provider in self.providers if provider.name == name), None)
+
+
+class Box(Model):
+    __slots__ = ("tag", "username", "name", "short_description", "private", "downloads", "created_at", "updated_at",
+                 "current_version", "versions")
+    _nested = {"current_version": Version}
+    _lists = {"versions": Version}
+
+    def version(self, version):
+        return next((v for v in self.versions if v.version == version), None)
+
+
+class User(Model):
+    __slots__ = ("username", "boxes")
+    _lists = {"boxes": Box}
@@ -0,0 +1,98 @@
+import csv
+import json
+import sys
+
+FORMATS = ["table", "json", "ndjson", "csv"]
+
+
+class Writer:
+    # Rows are dicts of raw API values keyed by column. Every format except the table writes
+    # and flushes each row as soon as it is given, so a consumer sees the first one right away.
+    def __init__(self, columns, formatters=None, stream=None):
+        self.columns = columns
+        self.formatters = formatters or {}
+        self.stream = stream or sys.stdout
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _values(self, row):
+        return [row.get(key) for key, _ in self.columns]
+
+    def row(self, row):
+        self._write(row)
+        self.rows += 1
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class TableWriter(Writer):
+    # prettytable needs every row to size the columns, so this one is printed on close
+    def __init__(self, columns, formatters=None, stream=None):
+        import prettytable
+
+        super().__init__(columns, formatters, stream)
+        self.table = prettytable.PrettyTable([title for _, title in columns])
+
+    def _write(self, row):
+        values = []
+        for key, _ in self.columns:
+            value = row.get(key)
+            if key in self.formatters:
+                value = self.formatters[key](value)
+            values.append(value)
+        self.table.add_row(values)
+
+    def row(self, row):
+        self._write(row)
+        self.rows += 1
+
+    def close(self):
+        if self.rows:
+            print(self.table, file=self.stream)
+
+
+class JsonWriter(Writer):
+    def _record(self, row):
+        return {key: row.get(key) for key, _ in self.columns}
+
+    def _write(self, row):
+        self.stream.write(",\n" if self.rows else "[")
+        self.stream.write(json.dumps(self._record(row)))
+
+    def close(self):
+        self.stream.write("]\n" if self.rows else "[]\n")
+        self.stream.flush()
+
+
+class NdjsonWriter(JsonWriter):
+    def _write(self, row):
+        self.stream.write(json.dumps(self._record(row)) + "\n")
+
+    def close(self):
+        pass
+
+
+class CsvWriter(Writer):
+    def __init__(self, columns, formatters=None, stream=None):
+        super().__init__(columns, formatters, stream)
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow([key for key, _ in columns])
+
+    def _write(self, row):
+        self.writer.writerow([", ".join(value) if isinstance(value, list) else value for value in self._values(row)])
+
+
+WRITERS = {"table": TableWriter, "json": JsonWriter, "ndjson": NdjsonWriter, "csv": CsvWriter}
+
+
+def open_writer(format, columns, formatters=None, stream=None):
+    # columns is a list of (key, table heading); formatters map a key to a function that turns
+    # the raw value into what the table shows (machine-readable formats keep the raw value)
+    return WRITERS[format](columns, formatters, stream)
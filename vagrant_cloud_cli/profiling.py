@@ -0,0 +1,53 @@
+import sys
+
+from vagrant_cloud_cli.upload import format_size
+
+REPORT_LINES = 30
+
+
+def _cpu(func, args, output):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        if output:
+            profiler.dump_stats(output)
+            print("CPU profile written to '%s' (read it with pstats or snakeviz)" % output, file=sys.stderr)
+        else:
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+
+
+def _mem(func, args, output):
+    import tracemalloc
+
+    tracemalloc.start(25)
+    try:
+        return func(*args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if output:
+            snapshot.dump(output)
+            print("Memory snapshot written to '%s' (load it with tracemalloc.Snapshot.load)" % output,
+                  file=sys.stderr)
+        else:
+            snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                               tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")])
+            print("Peak traced memory: %s, still allocated at exit: %s" % (format_size(peak), format_size(current)),
+                  file=sys.stderr)
+            for stat in snapshot.statistics("lineno")[:REPORT_LINES]:
+                print("%10s %7d blocks  %s" % (format_size(stat.size), stat.count, stat.traceback), file=sys.stderr)
+
+
+def profiled(mode, output, func, *args):
+    # Runs func(*args) under cProfile ("cpu") or tracemalloc ("mem"). The report goes to stderr,
+    # or the raw pstats/snapshot data to output, even if func exits or raises.
+    # Only the calling thread is profiled by cProfile, worker threads of apply/publish aren't.
+    return (_cpu if mode == "cpu" else _mem)(func, args, output)
@@ -0,0 +1,38 @@
+import datetime
+import re
+
+from vagrant_cloud_cli.models import parse_time
+
+UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def duration(text):
+    # "30d", "12h", "2w" or "90m", a plain number is days
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([mhdw]?)", text.strip())
+    if not match:
+        raise ValueError("invalid duration '%s'" % text)
+    return datetime.timedelta(seconds=float(match.group(1)) * UNITS[match.group(2) or "d"])
+
+
+def count(text):
+    # A number of versions, argparse reports the ValueError as "invalid count value"
+    value = int(text)
+    if value < 0:
+        raise ValueError("negative count '%s'" % text)
+    return value
+
+
+def select_versions(box, keep_last=None, older_than=None, keep_released=False, now=None):
+    # The versions of box to delete, newest first: everything but the keep_last newest, of those
+    # only the ones created more than older_than ago and, with keep_released, not released
+    if keep_last is not None and keep_last < 0:
+        raise ValueError("keep_last can't be negative")
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    versions = sorted(box.versions, key=lambda version: parse_time(version.created_at), reverse=True)
+    if keep_last is not None:
+        versions = versions[keep_last:]
+    if older_than is not None:
+        versions = [version for version in versions if parse_time(version.created_at) < now - older_than]
+    if keep_released:
+        versions = [version for version in versions if version.status != "active"]
+    return versions
@@ -0,0 +1,219 @@
+import functools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from vagrant_cloud_cli.upload import format_size
+
+PHASES = ("dns", "connect", "tls", "wait", "transfer")
+
+# The span being sent by the current thread, connection setup adds its phase timings to it
+_local = threading.local()
+_getaddrinfo = socket.getaddrinfo
+
+
+def _timed_getaddrinfo(*args, **kwargs):
+    span = getattr(_local, "span", None)
+    started = time.perf_counter()
+    try:
+        return _getaddrinfo(*args, **kwargs)
+    finally:
+        if span is not None:
+            span.phases["dns"] += time.perf_counter() - started
+
+
+class Span:
+    def __init__(self, method, url, attempt):
+        parts = urlsplit(url)
+        self.method = method
+        # The query string of pre-signed storage URLs holds credentials
+        self.url = "%s://%s%s" % (parts.scheme, parts.netloc, parts.path)
+        self.path = parts.path
+        self.attempt = attempt
+        self.status = None
+        self.error = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.reused = True
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+
+class TimedConnectMixin:
+    def _new_conn(self):
+        span = getattr(_local, "span", None)
+        started = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            if span is not None:
+                span.reused = False
+                # Name resolution happens in here too and is recorded on its own
+                span.phases["connect"] += time.perf_counter() - started - span.phases["dns"]
+
+
+class TracedHTTPConnection(TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class TracedHTTPSConnection(TimedConnectMixin, HTTPSConnection):
+    def connect(self):
+        span = getattr(_local, "span", None)
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            if span is not None:
+                span.phases["tls"] += time.perf_counter() - started - span.phases["connect"] - span.phases["dns"]
+
+
+class TracedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TracedHTTPConnection
+
+
+class TracedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TracedHTTPSConnection
+
+
+class TracingAdapter(HTTPAdapter):
+    def __init__(self, tracer, **kwargs):
+        self.tracer = tracer
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TracedHTTPConnectionPool,
+                                                   "https": TracedHTTPSConnectionPool}
+
+    def send(self, request, stream=False, **kwargs):
+        span = self.tracer.start(request.method, request.url)
+        body = request.body
+        if body is not None:
+            span.bytes_sent = len(body) if hasattr(body, "__len__") else int(request.headers.get("Content-Length", 0))
+        _local.span = span
+        try:
+            r = super().send(request, stream=stream, **kwargs)
+            span.status = r.status_code
+            # Sending the request (and any upload body) up to the response headers
+            span.phases["wait"] = time.perf_counter() - span.started - sum(span.phases.values())
+            if stream:
+                span.bytes_received = int(r.headers.get("Content-Length", 0))
+            else:
+                received = time.perf_counter()
+                span.bytes_received = len(r.content)
+                span.phases["transfer"] = time.perf_counter() - received
+            return r
+        except BaseException as e:
+            # KeyboardInterrupt too, the span of an interrupted request is reported as failed
+            span.error = "%s: %s" % (type(e).__name__, e)
+            raise
+        finally:
+            _local.span = None
+            self.tracer.finish(span)
+
+
+class Tracer:
+    # Records one span per HTTP request sent through the API's session. Timings are split into
+    # DNS, TCP connect, TLS, wait (sending the request until the response headers arrive, which
+    # includes upload bodies and server time) and transfer (reading the response body).
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler
+        self.spans = []
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+
+    def install(self, api):
+        socket.getaddrinfo = _timed_getaddrinfo
+        self.api = api
+        self.adapter_class = api.adapter_class
+        api.adapter_class = functools.partial(TracingAdapter, self)
+        api._mount()
+
+    def uninstall(self):
+        socket.getaddrinfo = _getaddrinfo
+        self.api.adapter_class = self.adapter_class
+        self.api._mount()
+
+    def start(self, method, url):
+        attempt = getattr(self.scheduler.local, "attempt", 0) if self.scheduler else 0
+        return Span(method, url, attempt)
+
+    def finish(self, span):
+        span.duration = time.perf_counter() - span.started
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self, stream=None):
+        stream = stream or sys.stderr
+        elapsed = time.perf_counter() - self.started
+        spans = sorted(self.spans, key=lambda span: span.started)
+        retries = sum(1 for span in spans if span.attempt)
+        new = sum(1 for span in spans if not span.reused)
+        print("Trace: %d requests (%d retries) in %.2fs, %d new connections, %d reused, %s sent, %s received" %
+              (len(spans), retries, elapsed, new, len(spans) - new, format_size(sum(s.bytes_sent for s in spans)),
+               format_size(sum(s.bytes_received for s in spans))), file=stream)
+        print("Time spent in %s" % ", ".join("%s %.3fs" % (phase, sum(span.phases[phase] for span in spans))
+                                             for phase in PHASES), file=stream)
+
+        groups = {}
+        for span in spans:
+            key = (span.method, span.path, span.status or (span.error or "?").split(":")[0])
+            count, total = groups.get(key, (0, 0.0))
+            groups[key] = (count + 1, total + span.duration)
+        print("%5s  %-6s %-6s %8s  %s" % ("Count", "Method", "Status", "Time", "Path"), file=stream)
+        for (method, path, status), (count, total) in sorted(groups.items(), key=lambda item: -item[1][1]):
+            print("%5d  %-6s %-6s %7.3fs  %s" % (count, method, status, total, path), file=stream)
+
+    def write_otlp(self, path, name):
+        # OTLP/JSON: one root span for the command with a CLIENT span per request under it
+        trace_id = os.urandom(16).hex()
+        root_id = os.urandom(8).hex()
+        end_time = self.start_time + time.perf_counter() - self.started
+
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = [{"traceId": trace_id, "spanId": root_id, "name": name, "kind": 1,
+                  "startTimeUnixNano": str(int(self.start_time * 1e9)), "endTimeUnixNano": str(int(end_time * 1e9)),
+                  "attributes": [attribute("process.command_args", name)]}]
+        for span in self.spans:
+            attributes = [attribute("http.request.method", span.method), attribute("url.full", span.url),
+                          attribute("http.request.resend_count", span.attempt),
+                          attribute("http.request.body.size", span.bytes_sent),
+                          attribute("http.response.body.size", span.bytes_received),
+                          attribute("vagrant_cloud_cli.connection_reused", span.reused)]
+            if span.status is not None:
+                attributes.append(attribute("http.response.status_code", span.status))
+            attributes += [attribute("vagrant_cloud_cli.%s_ms" % phase, span.phases[phase] * 1000)
+                           for phase in PHASES]
+            failed = span.error or span.status >= 400
+            spans.append({"traceId": trace_id, "spanId": os.urandom(8).hex(), "parentSpanId": root_id,
+                          "name": "%s %s" % (span.method, span.path), "kind": 3,
+                          "startTimeUnixNano": str(int(span.start_time * 1e9)),
+                          "endTimeUnixNano": str(int((span.start_time + span.duration) * 1e9)),
+                          "attributes": attributes,
+                          "status": {"code": 2, "message": span.error or "HTTP %d" % span.status} if failed else {}})
+
+        data = {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", "vagrant-cloud-cli")]},
+            "scopeSpans": [{"scope": {"name": "vagrant_cloud_cli.trace"}, "spans": spans}],
+        }]}
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+
+from vagrant_cloud_cli.errors import VagrantCloudError
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+CHECKSUM_TYPES = ["md5", "sha1", "sha256", "sha384", "sha512"]
+
+
+class UploadError(VagrantCloudError):
+    pass
+
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024
+    return "%.1f TiB" % size
+
+
+class UploadStream:
+    # File wrapper handed to requests as the PUT body. http.client/urllib3 ask for small
+    # (8-16 KiB) blocks, we always hand back chunk_size bytes so each socket write is large.
+    # The checksum is computed from the same reads, so the file is only read once.
+    # With use_mmap the chunks are memoryview slices of the mapped file, so neither hashing nor
+    # sock.sendall() copy the data into Python bytes objects first.
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, checksum_type="sha256", use_mmap=True):
+        self.f = open(path, "rb")
+        self.size = os.fstat(self.f.fileno()).st_size
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.checksum_type = checksum_type
+        self.hash = hashlib.new(checksum_type) if checksum_type else None
+        self.sent = 0
+        self.started = None
+        self.finished = None
+        self.mm = None
+        self.view = None
+        if use_mmap and self.size:
+            try:
+                self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass
+            else:
+                if hasattr(self.mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    self.mm.madvise(mmap.MADV_SEQUENTIAL)
+                self.view = memoryview(self.mm)
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def checksum(self):
+        return self.hash.hexdigest() if self.hash else None
+
+    @property
+    def rate(self):
+        return self.sent / max(self.elapsed, 1e-6)
+
+    def read(self, size=-1):
+        if self.started is None:
+            self.started = time.monotonic()
+        if self.view is not None:
+            data = self.view[self.sent:self.sent + self.chunk_size]
+        else:
+            data = self.f.read(self.chunk_size)
+        if self.hash:
+            self.hash.update(data)
+        self.sent += len(data)
+        if self.progress:
+            self.progress(self.sent, self.size)
+        return data
+
+    def close(self):
+        if self.finished is None and self.started is not None:
+            self.finished = time.monotonic()
+        if self.mm is not None:
+            try:
+                self.view.release()
+                self.mm.close()
+            except BufferError:
+                # A slice is still referenced by the HTTP stack, the mapping goes when it does
+                pass
+            self.mm = self.view = None
+        self.f.close()
+
+
+class UploadJournal:
+    # Kept next to the box file so an interrupted or repeated upload of the same file to the
+    # same provider can be detected. The upload endpoint only accepts the whole object in one
+    # PUT, so "confirmed" is either 0 or the file size.
+    SUFFIX = ".upload-journal"
+
+    def __init__(self, file, tag, version, provider):
+        self.path = file + self.SUFFIX
+        self.file = file
+        self.target = {"tag": tag, "version": version, "provider": provider}
+
+    def _identity(self):
+        st = os.stat(self.file)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("target") != self.target:
+            return None
+        identity = data.get("file", {})
+        if {k: identity.get(k) for k in ("size", "mtime_ns")} != self._identity():
+            return None
+        return data
+
+    def complete(self):
+        data = self.load()
+        return data is not None and data["confirmed"] == data["file"]["size"]
+
+    def save(self, confirmed, checksum_type=None, checksum=None):
+        data = {
+            "target": self.target,
+            "file": dict(self._identity(), checksum_type=checksum_type, checksum=checksum),
+            "confirmed": confirmed,
+            "updated_at": time.time()
+        }
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print("Warning: Unable to write upload journal '%s': %s" % (self.path, e), file=sys.stderr)
+
+
+class Progress:
+    def __init__(self, stream=None, interval=1.0):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last = 0
+
+    def __call__(self, sent, total):
+        now = time.monotonic()
+        if now - self.last < self.interval and sent < total:
+            return
+        self.last = now
+        rate = sent / max(now - self.started, 1e-6)
+        percent = 100.0 * sent / total if total else 100.0
+        self.stream.write("\r%5.1f%% %s of %s (%s/s)" % (percent, format_size(sent), format_size(total),
+                                                         format_size(rate)))
+        if sent >= total:
+            self.stream.write("\n")
+        self.stream.flush()
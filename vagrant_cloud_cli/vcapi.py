@@ -1,59 +1,68 @@
+import functools
 import os
-import sys
 
 from getpass import getpass
-import dateutil.parser
-import prettytable
 import requests
 
+from vagrant_cloud_cli.cache import DiskCache
+from vagrant_cloud_cli.client import (API_ENDPOINT, NotFoundError, RequestScheduler, ValidationError,  # noqa: F401
+                                      VagrantCloudClient, VagrantCloudError, error_message, is_glob)
+from vagrant_cloud_cli.hashindex import HashIndex, default_index_path
+from vagrant_cloud_cli.models import parse_time
+from vagrant_cloud_cli.output import open_writer
+from vagrant_cloud_cli.upload import UploadError, format_size
 
-class VagrantCloudApi:
-    def __init__(self, parser):
-        self.parser = parser
-        self.API_ENDPOINT = "https://app.vagrantup.com/api/v1"
 
-        atlas_token = os.environ.get("ATLAS_TOKEN")
-        if not atlas_token:
-            atlas_token = os.environ.get("VAGRANT_CLOUD_TOKEN")
+@functools.lru_cache(maxsize=4096)
+def format_dt(date_string):
+    return parse_time(date_string).strftime("%c")
+
 
-        if not atlas_token:
-            print("Error: Neither ATLAS_TOKEN or VAGRANT_CLOUD_TOKEN are defined", file=sys.stderr)
-            exit(1)
+# What each bulk version action is called when done, and the status it leaves the version in
+VERSION_ACTIONS = {"release": ("released", "active"), "revoke": ("revoked", "revoked"), "delete": ("deleted", None)}
 
-        self.s = requests.session()
-        self.s.headers.update({
-            "Authorization": "Bearer %s" % atlas_token
-        })
+
+class VagrantCloudApi(VagrantCloudClient):
+    # The CLI commands on top of the client: each takes the parsed arguments, prints its results
+    # and returns 1 on failure. API errors a command doesn't handle itself are printed by cli.run.
+    def __init__(self, parser=None):
+        self.parser = parser
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        # A command reuses what it has already fetched, the next command (reset() is called
+        # between them) starts afresh
+        self._responses = {}
+        self.show_progress = True
+        # The agent runs each command with its client's environment, which may put the index elsewhere
+        path = default_index_path()
+        if self.hash_index is None or self.hash_index.path != path:
+            if self.hash_index is not None:
+                self.hash_index.close()
+            self.hash_index = HashIndex(path)
+
+    def _notice(self, message):
+        print(message)
 
     def _format_dt(self, date_string):
-        dt = dateutil.parser.parse(date_string)
-        return dt.strftime("%c")
-
-    def _get(self, page):
-        r = self.s.get(self.API_ENDPOINT + page)
-        r.raise_for_status()
-        return r
-
-    def _post(self, page, data):
-        r = self.s.post(self.API_ENDPOINT + page, json=data)
-        r.raise_for_status()
-        return r
-
-    def _put(self, page, data={}):
-        r = self.s.put(self.API_ENDPOINT + page, json=data)
-        r.raise_for_status()
-        return r
-
-    def _delete(self, page):
-        r = self.s.delete(self.API_ENDPOINT + page)
-        r.raise_for_status()
-        return r
-
-    def _upload(self, upload_path, file):
-        with open(file, "rb") as f:
-            r = self.s.put(upload_path, data=f)
-        r.raise_for_status()
-        return r
+        return format_dt(date_string)
+
+    def _report_task(self, task):
+        if task.state == "done":
+            print("[done] %s%s" % (task.name, ": %s" % task.result if task.result else ""))
+        elif task.state == "failed":
+            print("[failed] %s: %s" % (task.name, error_message(task.error)))
+        else:
+            print("[skipped] %s (a dependency failed)" % task.name)
+
+    def _not_found(self, tag, message):
+        # A 404 on a nested resource doesn't say which part is missing, only look the box up then
+        if self.box_exists(tag):
+            print(message)
+        else:
+            print("Box '%s' does not exist" % tag)
+        return 1
 
     def authenticate(self, args):
         raise NotImplementedError("Currently there is no way to know whether 2FA is enabled for an account "
@@ -74,488 +83,321 @@ class VagrantCloudApi:
         print(r.json())
 
     def validate(self, args):
-        try:
-            r = self._get("/authenticate")
-            print("API Token Validated")
-        except requests.HTTPError as e:
-            if e.response.status_code == 401:
-                print("API Token Invalid")
-                return 1
-            else:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                raise
+        if not self.validate_token():
+            print("API Token Invalid")
+            return 1
+        print("API Token Validated")
 
     def user(self, args):
         try:
-            r = self._get("/user/" + args.username)
-            data = r.json()
-            if len(data["boxes"]) > 0:
-                print("Available boxes for '%s':" % data["username"])
-                table = prettytable.PrettyTable(["Name", "Description", "Created", "Updated", "Current Version"])
-                for box in data["boxes"]:
-                    box["current_version"] = box["current_version"]["version"] if box[
-                        "current_version"] else "None Released"
-                    table.add_row(
-                        [box["name"], box["short_description"], self._format_dt(box["created_at"]),
-                         self._format_dt(box["updated_at"]),
-                         box["current_version"]])
-                print(table)
-            else:
-                print("No boxes available for %s" % data["username"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("No such user '%s'" % args.username)
-                return 1
-            else:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                raise
-
-    def _box_exists(self, tag):
-        try:
-            self._get("/box/" + tag)
-            return True
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                return False
-            else:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                raise
+            user = self.get_user(args.username)
+        except NotFoundError:
+            print("No such user '%s'" % args.username)
+            return 1
+        if args.format == "table":
+            if not user.boxes:
+                print("No boxes available for %s" % user.username)
+                return
+            print("Available boxes for '%s':" % user.username)
+        columns = [("name", "Name"), ("short_description", "Description"), ("created_at", "Created"),
+                   ("updated_at", "Updated"), ("current_version", "Current Version")]
+        formatters = {"created_at": self._format_dt, "updated_at": self._format_dt,
+                      "current_version": lambda version: version or "None Released"}
+        with open_writer(args.format, columns, formatters) as out:
+            for box in user.boxes:
+                out.row({"name": box.name, "short_description": box.short_description, "created_at": box.created_at,
+                         "updated_at": box.updated_at,
+                         "current_version": box.current_version.version if box.current_version else None})
 
     def box_info(self, args):
-        if not self._box_exists(args.tag):
+        try:
+            box = self.get_box(args.tag)
+        except NotFoundError:
             print("Box '%s' does not exist" % args.tag)
             return 1
-
-        try:
-            r = self._get("/box/" + args.tag)
-        except requests.HTTPError as e:
-            data = e.response.json()
-            for error in data["errors"]:
-                print("Error: %s" % error)
-            raise
-        data = r.json()
-        print("Details for '%s'" % data["tag"])
-        if data["short_description"]:
-            print("Description: %s\n" % data["short_description"])
-        if len(data["versions"]) > 0:
+        if args.format == "table":
+            print("Details for '%s'" % box.tag)
+            if box.short_description:
+                print("Description: %s\n" % box.short_description)
+            if not box.versions:
+                print("No versions available")
+                return
             print("Available versions:")
-            table = prettytable.PrettyTable(["Version", "Created", "Updated", "Providers"])
-            for box in data["versions"]:
-                if len(box["providers"]) > 0:
-                    providers = []
-                    for provider in box["providers"]:
-                        providers.append(provider["name"])
-                else:
-                    providers = ["None"]
-                table.add_row([box["version"], self._format_dt(box["created_at"]), self._format_dt(box["updated_at"]),
-                               ", ".join(providers)])
-            print(table)
-        else:
-            print("No versions available")
+        columns = [("version", "Version"), ("created_at", "Created"), ("updated_at", "Updated"),
+                   ("providers", "Providers")]
+        formatters = {"created_at": self._format_dt, "updated_at": self._format_dt,
+                      "providers": lambda providers: ", ".join(providers) or "None"}
+        with open_writer(args.format, columns, formatters) as out:
+            for version in box.versions:
+                out.row({"version": version.version, "created_at": version.created_at,
+                         "updated_at": version.updated_at,
+                         "providers": [provider.name for provider in version.providers]})
 
     def box_create(self, args):
-        data = {
-            "box": {
-                "username": args.username,
-                "name": args.box,
-                "short_description": args.description,
-                "is_private": args.private
-            }
-        }
-
         try:
-            r = self._post("/boxes", data)
-            data = r.json()
-            print("Box '%s' created successfully" % data["tag"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                print("Error: Box '%s/%s' already exists" % (args.username, args.box))
-                return 1
-            else:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                raise
-
-    def box_update(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
+            box = self.create_box(args.username, args.box, args.description, args.private)
+        except ValidationError:
+            print("Error: Box '%s/%s' already exists" % (args.username, args.box))
             return 1
+        print("Box '%s' created successfully" % box.tag)
 
-        data = {"box": {}}
-        values = 0
-
-        if args.name:
-            data["box"].update({"name": args.box})
-            values += 1
-        if args.description:
-            data["box"].update({"short_description": args.description})
-            values += 1
-        if args.private:
-            data["box"].update({"is_private": args.private})
-            values += 1
-        if args.public:
-            data["box"].update({"is_private": ~ args.public})
-            values += 1
-
-        if values == 0:
+    def box_update(self, args):
+        private = True if args.private else False if args.public else None
+        if args.name is None and args.description is None and private is None:
             self.parser.error("no arguments given")
-            exit(2)
         try:
-            r = self._put("/box/" + args.tag, data)
-            data = r.json()
-            print("Box '%s' updated successfully" % data["tag"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Specified box does not exist")
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                raise
-
-    def box_delete(self, args):
-        if not self._box_exists(args.tag):
+            box = self.update_box(args.tag, args.name, args.description, private)
+        except NotFoundError:
             print("Box '%s' does not exist" % args.tag)
             return 1
+        print("Box '%s' updated successfully" % box.tag)
 
+    def box_delete(self, args):
         if not args.force:
+            # Don't ask about something that isn't there
+            if not self.box_exists(args.tag):
+                print("Box '%s' does not exist" % args.tag)
+                return 1
             answer = input("Do you really want to delete the box '%s'? [y/N] " % args.tag)
             if answer.lower() != "y" and answer.lower() != "yes":
                 return
 
         try:
-            r = self._delete("/box/" + args.tag)
-            data = r.json()
-            print("Box '%s' deleted successfully" % data["tag"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Box '%s' does not exist" % args.tag)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
-
-    def box_version_info(self, args):
-        if not self._box_exists(args.tag):
+            box = self.delete_box(args.tag)
+        except NotFoundError:
             print("Box '%s' does not exist" % args.tag)
             return 1
+        print("Box '%s' deleted successfully" % box.tag)
 
+    def box_version_info(self, args):
         try:
-            r = self._get("/box/" + args.tag + "/version/" + args.version)
-            data = r.json()
+            version = self.get_version(args.tag, args.version)
+        except NotFoundError:
+            return self._not_found(args.tag, "Version '%s' of specified box does not exist" % args.version)
+        if args.format == "table":
             print("Version information for '%s' v%s" % (args.tag, args.version))
-            if len(data["providers"]) > 0:
-                table = prettytable.PrettyTable(["Provider", "Created", "Updated"])
-                for provider in data["providers"]:
-                    table.add_row([provider["name"], self._format_dt(provider["created_at"]),
-                                   self._format_dt(provider["updated_at"])])
-                print(table)
-            else:
+            if not version.providers:
                 print("No providers available")
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Version '%s' of specified box does not exist" % args.version)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+                return
+        columns = [("name", "Provider"), ("created_at", "Created"), ("updated_at", "Updated")]
+        formatters = {"created_at": self._format_dt, "updated_at": self._format_dt}
+        with open_writer(args.format, columns, formatters) as out:
+            for provider in version.providers:
+                out.row(provider.to_dict())
 
     def box_version_create(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
-            return 1
-
-        data = {
-            "version": {
-                "version": args.version,
-                "description": args.description
-            }
-        }
-
         try:
-            r = self._post("/box/" + args.tag + "/versions", data)
-            data = r.json()
-            print("Version '%s' created successfully" % data["version"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
+            version = self.create_version(args.tag, args.version, args.description)
+        except NotFoundError:
+            if not self.box_exists(args.tag):
+                print("Box '%s' does not exist" % args.tag)
                 return 1
-            else:
-                raise
+            raise
+        print("Version '%s' created successfully" % version.version)
 
     def box_version_update(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
-            return 1
-
-        data = {
-            "version": {}
-        }
-
-        values = 0
-
-        if args.newversion:
-            data["version"].update({"version": args.newversion})
-            values += 1
-        if args.description:
-            data["version"].update({"description": args.description})
-            values += 1
-
-        if values == 0:
+        if args.newversion is None and args.description is None:
             self.parser.error("no arguments given")
-            exit(2)
-
         try:
-            self._put("/box/" + args.tag + "/version/" + args.version, data)
-            print("Version '%s' updated successfully" % args.version)
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("404")
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+            self.update_version(args.tag, args.version, args.newversion, args.description)
+        except NotFoundError:
+            return self._not_found(args.tag, "Version '%s' does not exist" % args.version)
+        print("Version '%s' updated successfully" % args.version)
 
     def box_version_delete(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
-            return 1
-
+        if len(args.tags) > 1 or is_glob(args.tags[0]):
+            return self._bulk_version(args, "delete")
+        tag = args.tags[0]
         if not args.force:
+            # Don't ask about something that isn't there
+            if not self.box_exists(tag):
+                print("Box '%s' does not exist" % tag)
+                return 1
             answer = input(
-                "Do you really want to delete the version %s from box %s? [y/N] " % (args.version, args.tag))
+                "Do you really want to delete the version %s from box %s? [y/N] " % (args.version, tag))
             if answer.lower() != "y" and answer.lower() != "yes":
                 return
 
         try:
-            r = self._delete("/box/" + args.tag + "/version/" + args.version)
-            data = r.json()
-            print("Version '%s' deleted successfully" % data["version"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Version '%s' does not exist" % args.version)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+            version = self.delete_version(tag, args.version)
+        except NotFoundError:
+            return self._not_found(tag, "Version '%s' does not exist" % args.version)
+        print("Version '%s' deleted successfully" % version.version)
 
     def box_version_release(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
-            return 1
-
+        if len(args.tags) > 1 or is_glob(args.tags[0]):
+            return self._bulk_version(args, "release")
         try:
-            r = self._put("/box/" + args.tag + "/version/" + args.version + "/release")
-            data = r.json()
-            print("Version '%s' released successfully" % data["version"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Version '%s' does not exist" % args.version)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+            version = self.release_version(args.tags[0], args.version)
+        except NotFoundError:
+            return self._not_found(args.tags[0], "Version '%s' does not exist" % args.version)
+        print("Version '%s' released successfully" % version.version)
 
     def box_version_revoke(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
+        if len(args.tags) > 1 or is_glob(args.tags[0]):
+            return self._bulk_version(args, "revoke")
+        try:
+            version = self.revoke_version(args.tags[0], args.version)
+        except NotFoundError:
+            return self._not_found(args.tags[0], "Version '%s' does not exist" % args.version)
+        print("Version '%s' revoked successfully" % version.version)
+
+    def _version_action(self, action, tag, version, named):
+        # Returns None when the action was done, or why nothing needed doing. Only the box's
+        # document is looked at when the action fails, to tell those cases from real failures.
+        try:
+            getattr(self, action + "_version")(tag, version)
+            return None
+        except (NotFoundError, ValidationError) as e:
+            error = e
+        try:
+            box = self.get_box(tag)
+        except NotFoundError:
+            raise VagrantCloudError("Box does not exist")
+        current = box.version(version)
+        if current is None:
+            # Boxes matched by a glob don't all have to have the version
+            if named:
+                raise VagrantCloudError("Version does not exist")
+            return "no such version"
+        done, status = VERSION_ACTIONS[action]
+        if status and current.status == status:
+            return "already %s" % done
+        raise error
+
+    def _bulk_version(self, args, action):
+        from vagrant_cloud_cli.executor import Executor
+
+        if any("/" not in tag for tag in args.tags):
+            self.parser.error("box tags must be in the format 'myuser/test' or 'myuser/*'")
+        tags = self.expand_tags(args.tags)
+        if not tags:
+            print("No boxes match %s" % ", ".join(args.tags))
             return 1
+        if action == "delete" and not args.force:
+            answer = input("Do you really want to delete the version %s from %d boxes (%s)? [y/N] " %
+                           (args.version, len(tags), ", ".join(tags)))
+            if answer.lower() != "y" and answer.lower() != "yes":
+                return
 
-        try:
-            r = self._put("/box/" + args.tag + "/version/" + args.version + "/revoke")
-            data = r.json()
-            print("Version '%s' revoked successfully" % data["version"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Version '%s' does not exist" % args.version)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+        self._set_concurrency(args.jobs)
+        executor = Executor(args.jobs, self._report_task)
+        for tag in tags:
+            executor.add("%s %s v%s" % (action, tag, args.version),
+                         functools.partial(self._version_action, action, tag, args.version, tag in args.tags))
+        counts = executor.run()
+        unchanged = sum(1 for task in executor.tasks if task.state == "done" and task.result)
+        print("%d boxes: %d %s, %d unchanged, %d failed" % (len(tags), counts.get("done", 0) - unchanged,
+                                                             VERSION_ACTIONS[action][0], unchanged,
+                                                             counts.get("failed", 0)))
+        if counts.get("failed"):
+            return 1
 
-    def box_provider_info(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
+    def box_version_prune(self, args):
+        from vagrant_cloud_cli.executor import Executor
+        from vagrant_cloud_cli.prune import select_versions
+
+        if args.keep_last is None and args.older_than is None:
+            self.parser.error("give --keep-last, --older-than or both")
+        if any("/" not in tag for tag in args.tags):
+            self.parser.error("box tags must be in the format 'myuser/test' or 'myuser/*'")
+        tags = self.expand_tags(args.tags)
+        if not tags:
+            print("No boxes match %s" % ", ".join(args.tags))
             return 1
 
-        try:
-            r = self._get("/box/" + args.tag + "/version/" + args.version + "/provider/" + args.provider)
-            data = r.json()
-            print("Information for provider '%s' for '%s' v%s" % (data["name"], args.tag, args.version))
-            print("Created: %s" % self._format_dt(data["created_at"]))
-            print("Updated: %s" % self._format_dt(data["updated_at"]))
-            print("Download URL: %s" % data["download_url"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Provider '%s' of specified box does not exist" % args.provider)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+        # One GET per box for all of its versions, then only the DELETEs
+        self._set_concurrency(args.jobs)
+        boxes = self.get_boxes(tags, args.jobs)
+        executor = Executor(args.jobs, self._report_task)
+        plans = []
+        missing = 0
+        for tag in tags:
+            box = boxes[tag]
+            if box is None:
+                print("Box '%s' does not exist" % tag)
+                missing += 1
+                continue
+            versions = select_versions(box, args.keep_last, args.older_than, args.keep_released)
+            tasks = [executor.add("delete %s v%s" % (tag, version.version),
+                                  functools.partial(self._prune_version, tag, version.version))
+                     for version in versions]
+            plans.append((box, tasks))
+
+        if not executor.tasks:
+            print("Nothing to prune")
+            return 1 if missing else None
+        if args.dry_run:
+            for box, tasks in plans:
+                print("%s: would delete %d of %d versions" % (box.tag, len(tasks), len(box.versions)))
+                for task in tasks:
+                    print("  %s" % task.name)
+            return 1 if missing else None
+        if not args.force:
+            answer = input("Do you really want to delete %d versions from %d boxes? [y/N] " %
+                           (len(executor.tasks), len(plans)))
+            if answer.lower() != "y" and answer.lower() != "yes":
+                return
 
-    def box_provider_create(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
+        executor.run()
+        failed = missing
+        for box, tasks in plans:
+            deleted = sum(1 for task in tasks if task.state == "done")
+            failed += len(tasks) - deleted
+            print("%s: %d deleted, %d failed, %d kept" % (box.tag, deleted, len(tasks) - deleted,
+                                                          len(box.versions) - deleted))
+        if failed:
             return 1
 
-        data = {
-            "provider": {
-                "name": args.provider,
-                "url": args.url
-            }
-        }
+    def _prune_version(self, tag, version):
+        self.delete_version(tag, version)
+
+    def box_provider_info(self, args):
+        try:
+            provider = self.get_provider(args.tag, args.version, args.provider)
+        except NotFoundError:
+            return self._not_found(args.tag, "Provider '%s' of specified box does not exist" % args.provider)
+        if args.format == "table":
+            print("Information for provider '%s' for '%s' v%s" % (provider.name, args.tag, args.version))
+            print("Created: %s" % self._format_dt(provider.created_at))
+            print("Updated: %s" % self._format_dt(provider.updated_at))
+            print("Download URL: %s" % provider.download_url)
+            return
+        columns = [("name", "Provider"), ("created_at", "Created"), ("updated_at", "Updated"),
+                   ("download_url", "Download URL")]
+        with open_writer(args.format, columns) as out:
+            out.row(provider.to_dict())
 
+    def box_provider_create(self, args):
         try:
-            r = self._post("/box/" + args.tag + "/version/" + args.version + "/providers", data)
-            data = r.json()
-            print("Provider '%s' created successfully" % data["name"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
+            provider = self.create_provider(args.tag, args.version, args.provider, args.url, args.checksum,
+                                            args.checksum_type)
+        except NotFoundError:
+            if not self.box_exists(args.tag):
+                print("Box '%s' does not exist" % args.tag)
                 return 1
-            else:
-                raise
+            raise
+        print("Provider '%s' created successfully" % provider.name)
 
     def box_provider_update(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
-            return 1
-
-        data = {
-            "version": {}
-        }
-
-        values = 0
-
-        if args.newprovider:
-            data["provider"].update({"name": args.newprovider})
-            values += 1
-        if args.url:
-            data["provider"].update({"url": args.url})
-            values += 1
-
-        if values == 0:
+        if args.newprovider is None and args.url is None and not args.checksum:
             self.parser.error("no arguments given")
-            exit(2)
-
         try:
-            self._put("/box/" + args.tag + "/version/" + args.version + "/provider/" + args.provider, data)
-            print("Provider '%s' updated successfully" % args.provider)
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
+            self.update_provider(args.tag, args.version, args.provider, args.newprovider, args.url, args.checksum,
+                                 args.checksum_type)
+        except NotFoundError:
+            if not self.box_exists(args.tag):
+                print("Box '%s' does not exist" % args.tag)
                 return 1
-            else:
-                raise
+            raise
+        print("Provider '%s' updated successfully" % args.provider)
 
     def box_provider_delete(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
-            return 1
-
         if not args.force:
+            # Don't ask about something that isn't there
+            if not self.box_exists(args.tag):
+                print("Box '%s' does not exist" % args.tag)
+                return 1
             answer = input(
                 "Do you really want to delete the provider %s from version v%s of box %s? [y/N] " %
                 (args.provider, args.version, args.tag))
@@ -563,48 +405,165 @@ class VagrantCloudApi:
                 return
 
         try:
-            r = self._delete("/box/" + args.tag + "/version/" + args.version + "/provider/" + args.provider)
-            data = r.json()
-            print("Provider '%s' deleted successfully" % data["name"])
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                print("Provider '%s' does not exist" % args.provider)
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            else:
-                raise
+            provider = self.delete_provider(args.tag, args.version, args.provider)
+        except NotFoundError:
+            return self._not_found(args.tag, "Provider '%s' does not exist" % args.provider)
+        print("Provider '%s' deleted successfully" % provider.name)
 
     def box_provider_upload(self, args):
-        if not self._box_exists(args.tag):
-            print("Box '%s' does not exist" % args.tag)
+        checksum_type = args.checksum_type if args.checksum_type != "none" else None
+        try:
+            stream = self.upload_provider(args.tag, args.version, args.provider, args.file,
+                                          args.chunk_size * 1024 * 1024, checksum_type, args.direct,
+                                          not args.no_mmap, args.force)
+        except UploadError as e:
+            print("Error: %s" % e)
+            return 1
+        except NotFoundError:
+            return self._not_found(args.tag, "Error: Provider does not exist")
+        if stream is None:
+            print("Provider '%s' already has the contents of '%s', skipping (use --force to upload again)"
+                  % (args.provider, args.file))
+            return
+
+        print("Provider '%s' uploaded successfully (%s in %.1fs, %s/s)" %
+              (args.provider, format_size(stream.sent), stream.elapsed, format_size(stream.rate)))
+        if checksum_type:
+            print("Checksum (%s): %s" % (checksum_type, stream.checksum))
+
+    def box_provider_download(self, args):
+        from vagrant_cloud_cli.download import DownloadError
+
+        path = args.output or "%s-%s-%s.box" % (args.tag.replace("/", "-"), args.version, args.provider)
+        if os.path.exists(path) and not args.force:
+            print("Error: '%s' already exists (use --force to overwrite it)" % path)
             return 1
-
         try:
-            r = self._get("/box/" + args.tag + "/version/" + args.version + "/provider/" + args.provider + "/upload")
-            data = r.json()
-            upload_path = data["upload_path"]
+            download = self.download_provider(args.tag, args.version, args.provider, path, args.jobs,
+                                              args.segment_size * 1024 * 1024, not args.no_verify)
+        except DownloadError as e:
+            print("Error: %s" % e)
+            return 1
+        except NotFoundError:
+            return self._not_found(args.tag, "Provider '%s' of specified box does not exist" % args.provider)
+
+        if download.resumed:
+            print("Resumed '%s', %s were already downloaded" % (path, format_size(download.resumed)))
+        print("Downloaded '%s' (%s in %.1fs, %s/s over %d connections)" %
+              (path, format_size(download.received), download.elapsed, format_size(download.rate),
+               download.connections))
+        if download.expected:
+            print("Checksum (%s): %s verified" % (download.checksum_type, download.checksum))
+        else:
+            print("Checksum (%s): %s (not verified)" % (download.checksum_type, download.checksum))
+
+    def _apply(self, boxes, args, remote=None):
+        from vagrant_cloud_cli.executor import Executor
+        from vagrant_cloud_cli.manifest import fetch_remote, plan
+
+        self._set_concurrency(args.jobs)
+        if remote is None:
             try:
-                self._upload(upload_path, args.file)
-                print("Provider '%s' uploaded successfully" % args.provider)
+                remote = fetch_remote(self, boxes, args.jobs)
             except requests.HTTPError as e:
-                raise
+                print("Error: %s" % error_message(e))
+                return 1
+
+        executor = Executor(args.jobs, self._report_task)
+        upload_options = {"chunk_size": args.chunk_size * 1024 * 1024, "direct": args.direct}
+        plan(self, boxes, remote, executor, upload_options, args.force_upload)
+        if not executor.tasks:
+            print("Nothing to do, remote state matches the manifest")
+            return
+        if args.dry_run:
+            for task in executor.tasks:
+                print(task.name)
+            return
+
+        counts = executor.run()
+        print("%d operations: %d done, %d failed, %d skipped" % (len(executor.tasks), counts.get("done", 0),
+                                                                 counts.get("failed", 0), counts.get("skipped", 0)))
+        stats = self.scheduler.stats
+        if stats["retries"] or stats["throttled"]:
+            print("%d requests, %d retried, %d rate limited by the API, %d throttled waits (%.1fs)" %
+                  (stats["requests"], stats["retries"], stats["rate_limited"], stats["throttled"],
+                   stats["throttled_wait"]))
+        if counts.get("failed") or counts.get("skipped"):
+            return 1
+
+    def apply(self, args):
+        from vagrant_cloud_cli.manifest import ManifestError, load_manifest
+
+        try:
+            boxes = load_manifest(args.manifest)
+        except ManifestError as e:
+            print("Error: %s" % e)
+            return 1
+        return self._apply(boxes, args)
+
+    def box_publish(self, args):
+        from vagrant_cloud_cli.manifest import ManifestError, check_box
+
+        providers = []
+        for item in args.providers:
+            name, sep, location = item.partition("=")
+            if not sep or not name or not location:
+                self.parser.error("providers must be given as provider=file or provider=url")
+            provider = {"name": name, "checksum_type": args.checksum_type}
+            if location.startswith(("http://", "https://")):
+                provider["url"] = location
+            else:
+                provider["file"] = location
+            providers.append(provider)
+
+        version = {"version": args.version, "release": not args.no_release, "providers": providers}
+        if args.description:
+            version["description"] = args.description
+        box = {"tag": args.tag, "versions": [version]}
+        try:
+            check_box(box, os.getcwd())
+        except ManifestError as e:
+            print("Error: %s" % e)
+            return 1
+
+        try:
+            remote = {args.tag: self._get("/box/" + args.tag).json()}
         except requests.HTTPError as e:
             if e.response.status_code == 404:
-                print("Error: Provider does not exist")
-                return 1
-            elif e.response.status_code == 403:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
-                return 1
-            elif e.response.status_code == 422:
-                data = e.response.json()
-                for error in data["errors"]:
-                    print("Error: %s" % error)
+                print("Box '%s' does not exist" % args.tag)
                 return 1
-            else:
-                raise
+            print("Error: %s" % error_message(e))
+            return 1
+        return self._apply([box], args, remote)
+
+    def shell(self, args):
+        from vagrant_cloud_cli.batch import shell
+
+        return shell(self, args)
+
+    def batch(self, args):
+        from vagrant_cloud_cli.batch import batch
+
+        return batch(self, args)
+
+    def mirror(self, args):
+        from vagrant_cloud_cli.mirror import mirror
+
+        return mirror(self, args)
+
+    def cache_clear(self, args):
+        cache = DiskCache(self.token)
+        print("Removed %d cached responses from '%s'" % (cache.clear(), cache.path))
+        if os.path.exists(self.hash_index.path):
+            print("Removed %d file checksums from '%s'" % (self.hash_index.clear(), self.hash_index.path))
+
+    def cache_stats(self, args):
+        stats = DiskCache(self.token).stats()
+        print("Cache directory: %s" % stats["path"])
+        print("Entries: %d" % stats["entries"])
+        print("Size: %s of %s" % (format_size(stats["size"]), format_size(stats["max_size"])))
+        if stats["oldest_access"] is not None:
+            print("Least recently used entry: %ds ago" % stats["oldest_access"])
+        if os.path.exists(self.hash_index.path):
+            stats = self.hash_index.stats()
+            print("File checksum index: %s (%d files)" % (stats["path"], stats["entries"]))